@@ -25,3 +25,23 @@ class Tier(models.TextChoices):
             self.ENTERPRISE: 50 * 1024 * 1024 * 1024,
         }
         return limits.get(self, limits[self.FREE])
+
+    @property
+    def render_timeout(self):
+        limits = {
+            self.BETA: 120,
+            self.FREE: 60,
+            self.PRO: 180,
+            self.ENTERPRISE: 300,
+        }
+        return limits.get(self, limits[self.FREE])
+
+    @property
+    def render_memory_limit(self):
+        limits = {
+            self.BETA: 1024 * 1024 * 1024,
+            self.FREE: 512 * 1024 * 1024,
+            self.PRO: 1536 * 1024 * 1024,
+            self.ENTERPRISE: 3 * 1024 * 1024 * 1024,
+        }
+        return limits.get(self, limits[self.FREE])
@@ -61,6 +61,11 @@ class User(AbstractUser):
     def storage_limit(self):
         return Tier(self.tier).storage_limit
 
+    @property
+    def render_limits(self):
+        tier = Tier(self.tier)
+        return {"timeout": tier.render_timeout, "memory_limit": tier.render_memory_limit}
+
     @property
     def remaining_storage(self):
         return max(0, self.storage_limit - self.get_total_usage())
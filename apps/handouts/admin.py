@@ -24,6 +24,7 @@ class HandoutAdmin(ModelAdmin):
         "updated_at",
         "display_yaml_config",
         "get_readable_file_size",
+        "download_count",
         "last_downloaded_at",
     )
     list_filter = ("is_published", "project")
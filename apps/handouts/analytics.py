@@ -0,0 +1,115 @@
+import functools
+import json
+import logging
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from datetime import timezone as dt_timezone
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_BUFFER_KEY = "lectura:analytics:downloads"
+
+
+class RedisBuffer:
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url)
+
+    def append(self, event):
+        self.client.rpush(DOWNLOAD_BUFFER_KEY, event)
+
+    def drain(self, limit):
+        # MULTI/EXEC, so events appended meanwhile are neither read twice nor trimmed unread.
+        pipe = self.client.pipeline()
+        pipe.lrange(DOWNLOAD_BUFFER_KEY, 0, limit - 1)
+        pipe.ltrim(DOWNLOAD_BUFFER_KEY, limit, -1)
+        events, _ = pipe.execute()
+        return events
+
+    def restore(self, events):
+        if events:
+            self.client.lpush(DOWNLOAD_BUFFER_KEY, *reversed(events))
+
+
+@functools.lru_cache(maxsize=1)
+def get_download_buffer():
+    # Only a shared buffer can be drained by the flush task, which runs in another process.
+    if settings.ANALYTICS_BUFFER_URL:
+        return RedisBuffer(settings.ANALYTICS_BUFFER_URL)
+    return None
+
+
+def record_download(handout_id, file_size):
+    event = {"handout": str(handout_id), "size": file_size, "at": time.time()}
+    buffer = get_download_buffer()
+    try:
+        if buffer is None:
+            apply_download_events([event])
+        else:
+            buffer.append(json.dumps(event))
+    except Exception as e:
+        logger.warning(f"Failed to record download of {handout_id}: {e}")
+
+
+def drain_download_events(limit):
+    buffer = get_download_buffer()
+    return buffer.drain(limit) if buffer is not None else []
+
+
+def restore_download_events(events):
+    get_download_buffer().restore(events)
+
+
+def apply_download_events(events):
+    # Imported here since models imports utils, which imports this module.
+    from .models import Handout, HandoutDailyStats
+
+    totals = defaultdict(lambda: {"count": 0, "size": None, "at": None})
+    daily = defaultdict(lambda: {"downloads": 0, "bytes_served": 0})
+    for event in events:
+        handout_id = uuid.UUID(event["handout"])
+        at = datetime.fromtimestamp(event["at"], tz=dt_timezone.utc)
+        total = totals[handout_id]
+        total["count"] += 1
+        if total["at"] is None or at >= total["at"]:
+            total["at"], total["size"] = at, event["size"]
+        day = daily[handout_id, timezone.localdate(at)]
+        day["downloads"] += 1
+        day["bytes_served"] += event["size"]
+
+    with transaction.atomic():
+        # Events for handouts deleted since they were recorded are dropped.
+        existing = set(Handout.objects.filter(id__in=totals).values_list("id", flat=True))
+        for handout_id in existing:
+            total = totals[handout_id]
+            # A plain UPDATE leaves updated_at, and with it the handout's Last-Modified, untouched.
+            Handout.objects.filter(id=handout_id).update(
+                download_count=F("download_count") + total["count"],
+                file_size=total["size"],
+                last_downloaded_at=total["at"],
+            )
+
+        stats = HandoutDailyStats.objects.select_for_update().filter(
+            handout_id__in=existing, date__in={day for _, day in daily}
+        )
+        stats_by_key = {(stat.handout_id, stat.date): stat for stat in stats}
+        created = []
+        for (handout_id, day), values in daily.items():
+            if handout_id not in existing:
+                continue
+            stat = stats_by_key.get((handout_id, day))
+            if stat is None:
+                created.append(HandoutDailyStats(handout_id=handout_id, date=day, **values))
+                continue
+            stat.downloads += values["downloads"]
+            stat.bytes_served += values["bytes_served"]
+        HandoutDailyStats.objects.bulk_update(stats_by_key.values(), ["downloads", "bytes_served"])
+        HandoutDailyStats.objects.bulk_create(created)
+    return len(existing)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class HandoutsConfig(AppConfig):
     name = "handouts"
+
+    def ready(self):
+        import handouts.signals  # noqa
@@ -0,0 +1,172 @@
+import platform
+import random
+import resource
+import statistics
+import time
+import tracemalloc
+import uuid
+
+import weasyprint
+from django.conf import settings
+from django.template.loader import render_to_string
+from PIL import Image, ImageDraw
+from weasyprint import HTML
+
+from .enums import SectionLevel
+from .fetcher import CachingURLFetcher
+from .models import Handout, Section
+from .utils import (
+    PDF_TEMPLATE_NAME,
+    _compile_stylesheet,
+    _render_stylesheet,
+    build_render_context,
+    build_section_tree,
+    get_compiled_stylesheet,
+    get_font_config,
+    get_section_render_digest,
+    render_section_html,
+)
+
+LEVELS = [SectionLevel.SECTION, SectionLevel.SUBSECTION, SectionLevel.SUBSUBSECTION]
+SCRIPTS = {
+    "latin": "The layout engine breaks every paragraph into lines and measures each glyph run. ",
+    "cjk": "排版引擎會將每個段落切分成行，並逐一計算字形的寬度與間距。",
+    "thai": "ระบบจัดหน้าจะตัดบรรทัดของแต่ละย่อหน้าและวัดความกว้างของตัวอักษรทุกตัว ",
+}
+FORMULAS = [
+    r"\frac{a}{b} + \sqrt{x^2 + y^2}",
+    r"\sum_{i=1}^{n} i = \frac{n(n+1)}{2}",
+    r"\int_0^\infty e^{-x^2} dx = \frac{\sqrt{\pi}}{2}",
+    r"\begin{pmatrix} a & b \\ c & d \end{pmatrix}",
+]
+CODE_SAMPLE = """```python
+def fibonacci(n):
+    a, b = 0, 1
+    for _ in range(n):
+        a, b = b, a + b
+    return a
+```"""
+ADMONITION_TYPES = ["note", "tip", "warning", "danger"]
+STAGES = ["markdown", "template", "stylesheet", "layout", "write_pdf"]
+
+
+def write_image_fixtures(directory, count=3):
+    paths = []
+    for index in range(count):
+        image = Image.new("RGB", (800, 450), (40 * index % 255, 120, 200))
+        draw = ImageDraw.Draw(image)
+        draw.rectangle((50, 50, 750, 400), outline="white", width=8)
+        path = directory / f"figure-{index}.png"
+        image.save(path)
+        paths.append(path)
+    return paths
+
+
+def build_section_content(rng, params, images):
+    blocks = []
+    scripts = params["scripts"]
+    for paragraph in range(params["paragraphs"]):
+        text = "".join(SCRIPTS[scripts[(paragraph + i) % len(scripts)]] for i in range(4))
+        if params["math"]:
+            text += f" Inline ${rng.choice(FORMULAS)}$ in text."
+        blocks.append(text)
+    for _ in range(params["math"]):
+        blocks.append(f"$$\n{rng.choice(FORMULAS)}\n$$")
+    for _ in range(params["code_blocks"]):
+        blocks.append(CODE_SAMPLE)
+    for _ in range(params["tables"]):
+        rows = ["| Name | Value | Notes |", "|---|---|---|"]
+        rows += [f"| row {i} | {rng.randint(0, 999)} | {SCRIPTS[scripts[i % len(scripts)]][:24]} |" for i in range(8)]
+        blocks.append("\n".join(rows))
+    for _ in range(params["admonitions"]):
+        blocks.append(f"/// {rng.choice(ADMONITION_TYPES)}\n{SCRIPTS[scripts[0]]}\n///")
+    for index in range(params["images"]):
+        path = images[index % len(images)]
+        blocks.append(f"![Figure {index}]({path.as_uri()})")
+    return "\n\n".join(blocks)
+
+
+def build_synthetic_handout(params, images):
+    """Unsaved handout and sections, so benchmarks never touch the database."""
+    rng = random.Random(params["seed"])
+    handout = Handout(title="Benchmark Handout", subtitle="Synthetic|Content", description="Generated for benchmarks")
+    sections = []
+    parents = []
+    for index in range(params["sections"]):
+        # A section may nest one level below the previous one or close any number of levels.
+        depth = rng.randint(0, min(len(parents), params["depth"] - 1))
+        parent = parents[depth - 1] if depth else None
+        section = Section(
+            id=uuid.uuid4(),
+            handout=handout,
+            parent_id=parent.id if parent else None,
+            level=LEVELS[depth],
+            title=f"Section {index}",
+            content=build_section_content(rng, params, images),
+            order=index,
+        )
+        parents = parents[:depth] + [section]
+        sections.append(section)
+    return handout, build_section_tree(sections)
+
+
+def measure(stage, results, profile_memory, func, *args, **kwargs):
+    if profile_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    value = func(*args, **kwargs)
+    results[stage]["seconds"].append(round(time.perf_counter() - started, 6))
+    if profile_memory:
+        results[stage]["peak_kb"].append(tracemalloc.get_traced_memory()[1] // 1024)
+        tracemalloc.stop()
+    return value
+
+
+def render_fragments(sections):
+    for section in sections:
+        section.rendered_html = render_section_html(section.content)
+        section.render_digest = get_section_render_digest(section.content)
+
+
+def run_benchmark(params, images, iterations=3, profile_memory=False):
+    handout, sections = build_synthetic_handout(params, images)
+    results = {stage: {"seconds": [], "peak_kb": []} for stage in STAGES}
+    pdf_content = b""
+    pages = 0
+
+    for _ in range(iterations):
+        # Every iteration starts cold, except for the on-disk math, highlight and image caches after the first one.
+        _render_stylesheet.cache_clear()
+        _compile_stylesheet.cache_clear()
+        measure("markdown", results, profile_memory, render_fragments, sections)
+        context, stylesheet_context = build_render_context(handout, sections, {})
+        html_string = measure("template", results, profile_memory, render_to_string, PDF_TEMPLATE_NAME, context)
+        stylesheet = measure("stylesheet", results, profile_memory, get_compiled_stylesheet, stylesheet_context)
+        html = HTML(string=html_string, base_url=str(settings.BASE_DIR), url_fetcher=CachingURLFetcher())
+        document = measure(
+            "layout", results, profile_memory, html.render, stylesheets=[stylesheet], font_config=get_font_config()
+        )
+        pdf_content = measure("write_pdf", results, profile_memory, document.write_pdf)
+        pages = len(document.pages)
+
+    summary = {}
+    for stage, values in results.items():
+        summary[stage] = {
+            "seconds": values["seconds"],
+            "median_seconds": round(statistics.median(values["seconds"]), 6),
+            "min_seconds": min(values["seconds"]),
+        }
+        if profile_memory:
+            summary[stage]["peak_kb"] = values["peak_kb"]
+
+    return {
+        "params": params,
+        "iterations": iterations,
+        "python": platform.python_version(),
+        "weasyprint": weasyprint.__version__,
+        "stages": summary,
+        "total_median_seconds": round(sum(stage["median_seconds"] for stage in summary.values()), 6),
+        "pdf_bytes": len(pdf_content),
+        "pages": pages,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
@@ -0,0 +1,173 @@
+import logging
+import os
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+LOCK_PREFIX = "lectura:lock:"
+LOCK_POLL_INTERVAL = 0.2
+# Writes add to a per-process size estimate; the directory is only rescanned once the estimate passes
+# the budget or is this old, since other processes write to the same directory.
+EVICT_RESCAN_INTERVAL = 60
+# Eviction frees space down to this fraction of the budget, so the next writes do not rescan at once.
+EVICT_LOW_WATER = 0.9
+
+
+class LockWaitTimeout(TimeoutError):
+    pass
+
+
+class FileCache:
+    """Content-addressed on-disk cache with size-bounded LRU eviction."""
+
+    def __init__(self, name, dir_setting, max_bytes_setting, suffix=""):
+        self.name = name
+        self.dir_setting = dir_setting
+        self.max_bytes_setting = max_bytes_setting
+        self.suffix = suffix
+        # Directory -> (estimated bytes, monotonic time of the last scan).
+        self.sizes = {}
+
+    @property
+    def directory(self):
+        return Path(getattr(settings, self.dir_setting))
+
+    @property
+    def max_bytes(self):
+        return getattr(settings, self.max_bytes_setting)
+
+    def path_for(self, key):
+        return self.directory / key[:2] / f"{key}{self.suffix}"
+
+    def get_path(self, key):
+        path = self.path_for(key)
+        try:
+            # Touch on hit so eviction follows recency of use, not of creation.
+            os.utime(path)
+        except FileNotFoundError:
+            metrics.increment(f"{self.name}_cache.misses")
+            return None
+        metrics.increment(f"{self.name}_cache.hits")
+        return path
+
+    def get(self, key):
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def get_or_create_path(self, key, write, lock_timeout, wait_timeout=None, failure_ttl=0, transient_errors=()):
+        """Return the path of key, with at most one caller across processes running write() on a miss.
+
+        Concurrent callers wait for the lock holder and share its entry, for at most wait_timeout
+        (lock_timeout by default). If write() fails, the error replaces the lock for failure_ttl
+        seconds and is raised to every caller meanwhile, unless it is one of transient_errors.
+        The lock expires after lock_timeout, so a crashed holder delays the others instead of blocking them.
+        Only a shared Django cache (REDIS_CACHE_URL) makes this hold across processes.
+        """
+        path = self.path_for(key)
+        lock_key = f"{LOCK_PREFIX}{self.name}:{key}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + (wait_timeout or lock_timeout)
+        while not cache.add(lock_key, token, timeout=lock_timeout):
+            holder = cache.get(lock_key)
+            if isinstance(holder, Exception):
+                metrics.increment(f"{self.name}_cache.shared_failures")
+                raise holder
+            if time.monotonic() >= deadline:
+                raise LockWaitTimeout(f"Timed out waiting for another {self.name} cache writer.")
+            time.sleep(LOCK_POLL_INTERVAL)
+            if path.exists():
+                metrics.increment(f"{self.name}_cache.coalesced")
+                return path
+
+        try:
+            # The previous holder may have stored the entry just before releasing the lock.
+            if not path.exists():
+                path = self.create(key, write)
+            return path
+        except Exception as e:
+            if failure_ttl and not isinstance(e, transient_errors) and cache.get(lock_key) == token:
+                try:
+                    cache.set(lock_key, e, timeout=failure_ttl)
+                    token = None
+                except Exception:
+                    pass
+            raise
+        finally:
+            if token and cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    def create(self, key, write):
+        """Store whatever write(tmp_path) puts in a temporary file, atomically."""
+        path = self.path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        os.close(fd)
+        try:
+            write(tmp_path)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.track(size)
+        return path
+
+    def set(self, key, data):
+        return self.create(key, lambda tmp_path: Path(tmp_path).write_bytes(data))
+
+    def track(self, added):
+        directory = self.directory
+        estimate, scanned_at = self.sizes.get(directory, (None, 0))
+        stale = estimate is None or time.monotonic() - scanned_at > EVICT_RESCAN_INTERVAL
+        if stale or estimate + added > self.max_bytes:
+            self.evict()
+        else:
+            self.sizes[directory] = (estimate + added, scanned_at)
+
+    def evict(self):
+        directory = self.directory
+        entries = []
+        total = 0
+        for path in directory.glob(f"*/*{self.suffix}"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        if total > self.max_bytes:
+            target = self.max_bytes * EVICT_LOW_WATER
+            for _, size, path in sorted(entries):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+                metrics.increment(f"{self.name}_cache.evictions")
+                if total <= target:
+                    break
+            logger.info(f"Evicted {self.name} cache entries, {total} bytes remain")
+        self.sizes[directory] = (total, time.monotonic())
+
+    def stats(self):
+        counters = metrics.get_counters(
+            f"{self.name}_cache.hits", f"{self.name}_cache.misses", f"{self.name}_cache.evictions"
+        )
+        return {key.split(".", 1)[1]: value for key, value in counters.items()}
+
+
+pdf_cache = FileCache("pdf", "PDF_CACHE_DIR", "PDF_CACHE_MAX_BYTES", suffix=".pdf")
@@ -6,3 +6,16 @@ class SectionLevel(models.TextChoices):
     SECTION = "section", _("Section (H2)")
     SUBSECTION = "subsection", _("Subsection (H3)")
     SUBSUBSECTION = "subsubsection", _("Subsubsection (H4)")
+
+
+class ExportJobKind(models.TextChoices):
+    PDF = "pdf", _("Handout PDF")
+    ZIP = "zip", _("Project ZIP")
+
+
+class ExportJobStatus(models.TextChoices):
+    PENDING = "pending", _("Pending")
+    RUNNING = "running", _("Running")
+    SUCCESS = "success", _("Success")
+    FAILED = "failed", _("Failed")
+    CANCELLED = "cancelled", _("Cancelled")
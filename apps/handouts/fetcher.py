@@ -0,0 +1,153 @@
+import hashlib
+import json
+import logging
+import re
+import time
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from weasyprint import default_url_fetcher
+from weasyprint.urls import HTTP_HEADERS, URLFetchingError, iri_to_uri
+
+from . import metrics
+from .cache import FileCache
+from .images import DOWNSCALE_MIME_TYPES, downscale_image
+
+logger = logging.getLogger(__name__)
+
+MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+resource_cache = FileCache("fetch", "PDF_FETCH_CACHE_DIR", "PDF_FETCH_CACHE_MAX_BYTES", suffix=".bin")
+
+
+class CachingURLFetcher:
+    """WeasyPrint url_fetcher that keeps remote assets in an on-disk LRU cache and downscales large images."""
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout or settings.PDF_FETCH_TIMEOUT
+
+    def __call__(self, url):
+        local_media_url = settings.PDF_FETCH_LOCAL_MEDIA_URL
+        if local_media_url and url.startswith(local_media_url):
+            url = f"file://{settings.MEDIA_ROOT}/{url[len(local_media_url) :]}"
+
+        if not url.lower().startswith(("http://", "https://")):
+            result = default_url_fetcher(url, timeout=self.timeout)
+        else:
+            result = self.fetch_remote(url)
+        if result.get("mime_type") in DOWNSCALE_MIME_TYPES:
+            result = self.downscale(result)
+        return result
+
+    def downscale(self, result):
+        if "file_obj" in result:
+            with result.pop("file_obj") as file_obj:
+                result["string"] = file_obj.read()
+        data, mime_type = downscale_image(result["string"], result["mime_type"])
+        if data is result["string"]:
+            return result
+        # WeasyPrint may embed a JPEG straight from its path, which would bring back the original.
+        result.pop("path", None)
+        return {**result, "string": data, "mime_type": mime_type}
+
+    def fetch_remote(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        entry = self.load(key)
+        if entry and time.time() < entry[0]["expires_at"]:
+            metrics.increment("fetch.fresh")
+            return self.as_result(*entry)
+
+        headers = {"User-Agent": HTTP_HEADERS["User-Agent"], "Accept": "*/*"}
+        if entry and entry[0].get("etag"):
+            headers["If-None-Match"] = entry[0]["etag"]
+        if entry and entry[0].get("last_modified"):
+            headers["If-Modified-Since"] = entry[0]["last_modified"]
+
+        try:
+            with urlopen(Request(iri_to_uri(url), headers=headers), timeout=self.timeout) as response:
+                body = self.read_limited(response)
+                meta = self.build_meta(response.url, response.headers)
+        except HTTPError as e:
+            if e.code == 304 and entry:
+                meta, body = entry
+                refreshed = self.build_meta(meta["url"], e.headers, fallback=meta)
+                meta.update(ttl=refreshed["ttl"], expires_at=refreshed["expires_at"])
+                self.store(key, meta, body)
+                metrics.increment("fetch.revalidated")
+                return self.as_result(meta, body)
+            return self.handle_error(url, entry, e)
+        except (OSError, ValueError) as e:
+            return self.handle_error(url, entry, e)
+
+        metrics.increment("fetch.downloaded")
+        if meta["cacheable"]:
+            self.store(key, meta, body)
+        return self.as_result(meta, body)
+
+    def read_limited(self, response):
+        limit = settings.PDF_REMOTE_FETCH_MAX_BYTES
+        if int(response.headers.get("Content-Length") or 0) > limit:
+            raise ValueError(f"Response exceeds {limit} bytes")
+        # Reads at most one byte past the limit, so an unannounced oversized body is cut off too.
+        body = response.read(limit + 1)
+        if len(body) > limit:
+            raise ValueError(f"Response exceeds {limit} bytes")
+        return body
+
+    def handle_error(self, url, entry, error):
+        metrics.increment("fetch.errors")
+        if entry:
+            logger.warning(f"Serving stale copy of {url} after fetch error: {error}")
+            metrics.increment("fetch.stale_served")
+            return self.as_result(*entry)
+        raise URLFetchingError(f"Failed to fetch {url}: {error}") from error
+
+    def build_meta(self, url, headers, fallback=None):
+        fallback = fallback or {}
+        cache_control = headers.get("Cache-Control", "") or ""
+        max_age = MAX_AGE_RE.search(cache_control)
+        if max_age:
+            ttl = int(max_age.group(1))
+        else:
+            ttl = fallback.get("ttl", settings.PDF_FETCH_CACHE_TTL)
+        return {
+            "url": url,
+            "mime_type": headers.get_content_type() if headers.get("Content-Type") else fallback.get("mime_type"),
+            "encoding": headers.get_param("charset") or fallback.get("encoding"),
+            "etag": headers.get("ETag") or fallback.get("etag"),
+            "last_modified": headers.get("Last-Modified") or fallback.get("last_modified"),
+            "ttl": ttl,
+            "expires_at": time.time() + ttl,
+            "cacheable": "no-store" not in cache_control,
+        }
+
+    def load(self, key):
+        data = resource_cache.get(key)
+        if data is None:
+            return None
+        header, _, body = data.partition(b"\n")
+        try:
+            return json.loads(header), body
+        except ValueError:
+            return None
+
+    def store(self, key, meta, body):
+        if len(body) > settings.PDF_FETCH_MAX_OBJECT_BYTES:
+            return
+        resource_cache.set(key, json.dumps(meta).encode("utf-8") + b"\n" + body)
+
+    def as_result(self, meta, body):
+        return {
+            "string": body,
+            "mime_type": meta.get("mime_type"),
+            "encoding": meta.get("encoding"),
+            "redirected_url": meta["url"],
+        }
+
+
+def get_fetcher_stats():
+    stats = metrics.get_counters(
+        "fetch.fresh", "fetch.revalidated", "fetch.downloaded", "fetch.errors", "fetch.stale_served"
+    )
+    return {key.split(".", 1)[1]: value for key, value in stats.items()}
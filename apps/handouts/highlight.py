@@ -0,0 +1,76 @@
+import functools
+import hashlib
+
+import pygments
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import find_lexer_class_by_name, get_lexer_by_name
+from pygments.util import ClassNotFound
+
+from .cache import FileCache
+
+# Bump whenever a change to code highlighting alters the produced HTML.
+HIGHLIGHT_RENDERER_VERSION = "1"
+CODE_STYLE = "default"
+CODE_CSS_CLASS = "highlight"
+
+# Unlabeled blocks are scored against these lexers only, instead of every lexer Pygments ships.
+GUESS_LANGUAGES = [
+    "python",
+    "javascript",
+    "typescript",
+    "java",
+    "c",
+    "cpp",
+    "csharp",
+    "go",
+    "rust",
+    "bash",
+    "sql",
+    "html",
+    "css",
+    "json",
+    "yaml",
+    "r",
+    "php",
+    "ruby",
+]
+
+highlight_cache = FileCache("highlight", "CODE_HIGHLIGHT_CACHE_DIR", "CODE_HIGHLIGHT_CACHE_MAX_BYTES", suffix=".html")
+
+
+def get_code_digest(code, lang, style=CODE_STYLE):
+    key = f"{HIGHLIGHT_RENDERER_VERSION}:{pygments.__version__}:{style}:{lang or ''}:{code}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+@functools.lru_cache(maxsize=1024)
+def guess_language(code):
+    best_lang, best_score = "text", 0.0
+    for lang in GUESS_LANGUAGES:
+        score = find_lexer_class_by_name(lang).analyse_text(code)
+        if score > best_score:
+            best_lang, best_score = lang, score
+            if score >= 1.0:
+                break
+    return best_lang
+
+
+@functools.lru_cache(maxsize=128)
+def get_formatter(style):
+    return HtmlFormatter(cssclass=CODE_CSS_CLASS, style=style, wrapcode=True)
+
+
+def highlight_code(code, lang=None, style=CODE_STYLE):
+    digest = get_code_digest(code, lang, style)
+    cached = highlight_cache.get(digest)
+    if cached is not None:
+        return cached.decode("utf-8")
+
+    try:
+        lexer = get_lexer_by_name(lang or "")
+    except ClassNotFound:
+        lexer = get_lexer_by_name(guess_language(code))
+    rendered = highlight(code, lexer, get_formatter(style))
+    highlight_cache.set(digest, rendered.encode("utf-8"))
+    return rendered
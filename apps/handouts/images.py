@@ -0,0 +1,86 @@
+import hashlib
+import io
+import logging
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from .cache import FileCache
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever a change to image downscaling alters the produced variants.
+IMAGE_VARIANT_VERSION = "1"
+# Width of the A4 content box (210mm less 2.5cm margins), the widest an image can print.
+A4_CONTENT_WIDTH_IN = (210 - 50) / 25.4
+# WeasyPrint sizes images at one CSS pixel per image pixel, and CSS pixels are 1/96 in.
+CSS_DPI = 96
+DOWNSCALE_MIME_TYPES = {"image/jpeg", "image/png", "image/webp"}
+ORIENTATION_TAG = 0x0112
+# EXIF orientations that rotate the image by 90 degrees, swapping its width and height.
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+image_cache = FileCache("image", "PDF_IMAGE_CACHE_DIR", "PDF_IMAGE_CACHE_MAX_BYTES", suffix=".img")
+
+
+def get_target_width():
+    # Below 96 DPI a variant would be narrower than the page and print smaller than its source.
+    return round(A4_CONTENT_WIDTH_IN * max(settings.PDF_IMAGE_DPI, CSS_DPI))
+
+
+def get_variant_key(data, width):
+    source = hashlib.sha256(data).hexdigest()
+    key = f"{IMAGE_VARIANT_VERSION}:{source}:{width}:{settings.PDF_IMAGE_JPEG_QUALITY}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def get_upright_size(image):
+    if image.getexif().get(ORIENTATION_TAG, 1) in TRANSPOSED_ORIENTATIONS:
+        return image.height, image.width
+    return image.size
+
+
+def make_image_variant(data, width):
+    """Return (data, mime_type) of the image, upright and scaled down to width."""
+    with Image.open(io.BytesIO(data)) as image:
+        source_format = image.format
+        source_width, source_height = get_upright_size(image)
+        # Only the width is capped: images print at most as wide as the page, and scaling both sides
+        # by one factor keeps a max-width: 100% image at the size it printed before.
+        size = (width, round(source_height * width / source_width))
+        # Lets JPEG decode at a reduced scale instead of at full resolution.
+        image.draft(image.mode, size if image.size == (source_width, source_height) else size[::-1])
+        variant = ImageOps.exif_transpose(image).resize(size, Image.Resampling.LANCZOS)
+
+    buffer = io.BytesIO()
+    if source_format == "PNG" or variant.mode in ("RGBA", "LA", "PA") or "transparency" in variant.info:
+        variant.save(buffer, format="PNG", optimize=True)
+        return buffer.getvalue(), "image/png"
+    if variant.mode not in ("RGB", "L"):
+        variant = variant.convert("RGB")
+    variant.save(buffer, format="JPEG", quality=settings.PDF_IMAGE_JPEG_QUALITY, optimize=True)
+    return buffer.getvalue(), "image/jpeg"
+
+
+def downscale_image(data, mime_type):
+    """Return (data, mime_type) for a copy of the image no wider than it can print on A4 at PDF_IMAGE_DPI."""
+    if not settings.PDF_IMAGE_DPI or mime_type not in DOWNSCALE_MIME_TYPES:
+        return data, mime_type
+
+    width = get_target_width()
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if get_upright_size(image)[0] <= width:
+                return data, mime_type
+        key = get_variant_key(data, width)
+        cached = image_cache.get(key)
+        if cached is not None:
+            variant_mime_type, _, variant = cached.partition(b"\n")
+            return variant, variant_mime_type.decode("ascii")
+        variant, variant_mime_type = make_image_variant(data, width)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning(f"Failed to downscale image, embedding it as is: {e}")
+        return data, mime_type
+
+    image_cache.set(key, variant_mime_type.encode("ascii") + b"\n" + variant)
+    return variant, variant_mime_type
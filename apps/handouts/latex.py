@@ -0,0 +1,52 @@
+import base64
+import hashlib
+import html
+import logging
+
+import ziamath
+
+from .cache import FileCache
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever a change to formula rendering alters the produced SVG.
+MATH_RENDERER_VERSION = "1"
+INLINE_FONT_SIZE = 15
+BLOCK_FONT_SIZE = 18
+
+# SVG 1.1 output (<defs>/<use>) is what WeasyPrint's SVG renderer handles best.
+ziamath.config.svg2 = False
+
+math_cache = FileCache("math", "MATH_CACHE_DIR", "MATH_CACHE_MAX_BYTES", suffix=".svg")
+
+
+def get_formula_digest(latex, display=False):
+    key = f"{MATH_RENDERER_VERSION}:{ziamath.__version__}:{int(display)}:{latex}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def render_formula_svg(latex, display=False):
+    digest = get_formula_digest(latex, display)
+    svg = math_cache.get(digest)
+    if svg is None:
+        size = BLOCK_FONT_SIZE if display else INLINE_FONT_SIZE
+        try:
+            svg = ziamath.Latex(latex, size=size, inline=not display).svg().encode("utf-8")
+        except Exception as e:
+            logger.warning(f"Failed to render formula {latex!r}: {e}")
+            return None
+        math_cache.set(digest, svg)
+    return svg
+
+
+def render_formula_html(latex, display=False):
+    svg = render_formula_svg(latex, display)
+    css_class = "math-block" if display else "math-inline"
+    if svg is None:
+        return f'<code class="{css_class} math-error">{html.escape(latex)}</code>'
+
+    src = f"data:image/svg+xml;base64,{base64.b64encode(svg).decode('ascii')}"
+    alt = html.escape(latex, quote=True)
+    if display:
+        return f'<div class="math-block"><img src="{src}" alt="{alt}" /></div>'
+    return f'<img class="math-inline" src="{src}" alt="{alt}" />'
@@ -0,0 +1,69 @@
+import json
+import tempfile
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from handouts.benchmarks import SCRIPTS, run_benchmark, write_image_fixtures
+
+
+class Command(BaseCommand):
+    help = "Render a synthetic handout and report per-stage timings as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sections", type=int, default=40)
+        parser.add_argument("--depth", type=int, default=3, choices=[1, 2, 3])
+        parser.add_argument("--paragraphs", type=int, default=3, help="Paragraphs per section")
+        parser.add_argument("--code-blocks", type=int, default=1, help="Code blocks per section")
+        parser.add_argument("--tables", type=int, default=1, help="Tables per section")
+        parser.add_argument("--math", type=int, default=1, help="Display formulas per section")
+        parser.add_argument("--admonitions", type=int, default=1, help="Admonitions per section")
+        parser.add_argument("--images", type=int, default=0, help="Images per section")
+        parser.add_argument("--scripts", default="latin,cjk,thai", help="Comma-separated: latin, cjk, thai")
+        parser.add_argument("--iterations", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--memory", action="store_true", help="Record tracemalloc peaks (slows rendering)")
+        parser.add_argument("--label", default="", help="Free-form tag, e.g. a commit hash")
+        parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+
+    def handle(self, *args, **options):
+        scripts = [script.strip() for script in options["scripts"].split(",") if script.strip()]
+        unknown = set(scripts) - set(SCRIPTS)
+        if unknown or not scripts:
+            raise CommandError(f"Unknown scripts: {', '.join(sorted(unknown)) or 'none given'}")
+        if options["iterations"] < 1 or options["sections"] < 1:
+            raise CommandError("--iterations and --sections must be at least 1")
+
+        params = {
+            "sections": options["sections"],
+            "depth": options["depth"],
+            "paragraphs": options["paragraphs"],
+            "code_blocks": options["code_blocks"],
+            "tables": options["tables"],
+            "math": options["math"],
+            "admonitions": options["admonitions"],
+            "images": options["images"],
+            "scripts": scripts,
+            "seed": options["seed"],
+        }
+
+        # Isolated caches keep runs cold and comparable, and nothing leaves the machine.
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp_path = Path(tmp)
+            with override_settings(
+                PDF_CACHE_DIR=tmp_path / "pdf",
+                MATH_CACHE_DIR=tmp_path / "math",
+                PDF_FETCH_CACHE_DIR=tmp_path / "assets",
+                CODE_HIGHLIGHT_CACHE_DIR=tmp_path / "highlight",
+                PDF_IMAGE_CACHE_DIR=tmp_path / "images",
+            ):
+                images = write_image_fixtures(tmp_path)
+                report = run_benchmark(params, images, options["iterations"], options["memory"])
+
+        report["label"] = options["label"]
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            Path(options["output"]).write_text(output + "\n", encoding="utf-8")
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,123 @@
+import html
+import re
+import xml.etree.ElementTree as etree
+
+from markdown.blockprocessors import BlockProcessor
+from markdown.extensions import Extension
+from markdown.inlinepatterns import InlineProcessor
+from markdown.postprocessors import Postprocessor
+from markdown.treeprocessors import Treeprocessor
+
+from .highlight import highlight_code
+from .latex import render_formula_html
+from .theme import ADMONITION_ICONS
+
+BLOCK_MATH_RE = re.compile(r"\$\$(.+?)\$\$", re.DOTALL)
+# Formulas never span the STX/ETX-delimited placeholders of stashed code spans or inline HTML.
+BLOCK_MATH_PATTERN = r"\$\$([^\x02\x03]+?)\$\$"
+INLINE_MATH_PATTERN = r"\$([^\x02\x03]+?)\$"
+# What fenced_code and codehilite stash for a code block when use_pygments is off.
+PLAIN_CODE_BLOCK_RE = re.compile(
+    r'<pre(?: class="highlight")?><code(?: class="language-([^" ]+)(?: linenums)?")?>(.*?)</code></pre>\n?', re.DOTALL
+)
+
+
+class MathInlineProcessor(InlineProcessor):
+    def __init__(self, pattern, md, extension, display):
+        super().__init__(pattern, md)
+        self.extension = extension
+        self.display = display
+
+    def handleMatch(self, m, data):
+        html = self.extension.render(m.group(1).strip(), self.display)
+        return self.md.htmlStash.store(html), m.start(0), m.end(0)
+
+
+class MathBlockProcessor(BlockProcessor):
+    def __init__(self, parser, extension):
+        super().__init__(parser)
+        self.extension = extension
+
+    def test(self, parent, block):
+        return block.startswith("$$")
+
+    def run(self, parent, blocks):
+        # A display formula may span blank lines, so gather blocks until the closing $$.
+        for end in range(len(blocks)):
+            text = "\n\n".join(blocks[: end + 1]).rstrip()
+            close = text.find("$$", 2)
+            if close != -1:
+                break
+        else:
+            return False
+
+        # Text after the closing $$ leaves the formula to the inline display pattern.
+        match = BLOCK_MATH_RE.fullmatch(text)
+        if close != len(text) - 2 or not match:
+            return False
+
+        del blocks[: end + 1]
+        p = etree.SubElement(parent, "p")
+        p.text = self.parser.md.htmlStash.store(self.extension.render(match.group(1).strip(), True))
+
+
+class MathExtension(Extension):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Repeated formulas share one cache lookup and one data URI, which WeasyPrint decodes once.
+        self.rendered = {}
+
+    def render(self, latex, display):
+        if (latex, display) not in self.rendered:
+            self.rendered[(latex, display)] = render_formula_html(latex, display)
+        return self.rendered[(latex, display)]
+
+    def reset(self):
+        self.rendered = {}
+
+    def extendMarkdown(self, md):
+        md.registerExtension(self)
+        md.parser.blockprocessors.register(MathBlockProcessor(md.parser, self), "math_block", 75)
+        # Below backticks (190) so code spans keep their dollar signs.
+        md.inlinePatterns.register(MathInlineProcessor(BLOCK_MATH_PATTERN, md, self, True), "math_display", 186)
+        md.inlinePatterns.register(MathInlineProcessor(INLINE_MATH_PATTERN, md, self, False), "math_inline", 185)
+
+
+class AdmonitionIconTreeprocessor(Treeprocessor):
+    def run(self, root):
+        for div in root.iter("div"):
+            classes = div.get("class", "").split()
+            if "admonition" not in classes:
+                continue
+            svg = next((ADMONITION_ICONS[c] for c in classes if c in ADMONITION_ICONS), None)
+            title = div[0] if len(div) else None
+            if svg is None or title is None or "admonition-title" not in title.get("class", "").split():
+                continue
+
+            icon = etree.Element("span", {"class": "admonition-icon"})
+            icon.text = self.md.htmlStash.store(svg)
+            icon.tail, title.text = title.text, None
+            title.insert(0, icon)
+
+
+class AdmonitionIconExtension(Extension):
+    def extendMarkdown(self, md):
+        # After inline processing (20) so the stashed SVG is not parsed as Markdown.
+        md.treeprocessors.register(AdmonitionIconTreeprocessor(md), "admonition_icons", 15)
+
+
+class CodeHighlightPostprocessor(Postprocessor):
+    def run(self, text):
+        blocks = self.md.htmlStash.rawHtmlBlocks
+        for index, block in enumerate(blocks):
+            match = PLAIN_CODE_BLOCK_RE.fullmatch(block) if isinstance(block, str) else None
+            if match:
+                lang = html.unescape(match.group(1)) if match.group(1) else None
+                blocks[index] = highlight_code(html.unescape(match.group(2)).strip("\n"), lang)
+        return text
+
+
+class CodeHighlightExtension(Extension):
+    def extendMarkdown(self, md):
+        # Ahead of raw HTML restoration (30) so the highlighted markup is what gets substituted.
+        md.postprocessors.register(CodeHighlightPostprocessor(md), "code_highlight", 35)
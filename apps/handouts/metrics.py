@@ -0,0 +1,76 @@
+import contextlib
+import contextvars
+import logging
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = "lectura:metrics:"
+
+_spans = contextvars.ContextVar("render_spans", default=None)
+
+
+def increment(name, delta=1):
+    key = f"{METRICS_PREFIX}{name}"
+    try:
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            cache.add(key, 0, timeout=None)
+            cache.incr(key, delta)
+    except Exception as e:
+        logger.warning(f"Failed to record metric {name}: {e}")
+
+
+def get_counters(*names):
+    values = cache.get_many([f"{METRICS_PREFIX}{name}" for name in names])
+    return {name: values.get(f"{METRICS_PREFIX}{name}", 0) for name in names}
+
+
+def record_timing(name, seconds):
+    increment(f"{name}.count")
+    increment(f"{name}.total_ms", int(seconds * 1000))
+
+
+def get_timings(*names):
+    counters = get_counters(*[f"{name}.{field}" for name in names for field in ("count", "total_ms")])
+    return {name: {"count": counters[f"{name}.count"], "total_ms": counters[f"{name}.total_ms"]} for name in names}
+
+
+@contextlib.contextmanager
+def span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        record_timing(f"render.{name}", duration)
+        spans = _spans.get()
+        if spans is not None:
+            spans.append((name, duration))
+
+
+@contextlib.contextmanager
+def collect_spans():
+    spans = []
+    token = _spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _spans.reset(token)
+
+
+def extend_spans(spans):
+    """Add spans timed elsewhere, e.g. in a sandboxed child, to the current collection."""
+    collected = _spans.get()
+    if collected is not None:
+        collected.extend(spans)
+
+
+def format_server_timing(spans):
+    totals = {}
+    for name, duration in spans:
+        totals[name] = totals.get(name, 0) + duration
+    return ", ".join(f"{name};dur={duration * 1000:.1f}" for name, duration in totals.items())
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-17 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('handouts', '0009_exportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='section',
+            name='rendered_html',
+            field=models.TextField(blank=True, editable=False, help_text='HTML fragment rendered from content'),
+        ),
+        migrations.AddField(
+            model_name='section',
+            name='render_digest',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
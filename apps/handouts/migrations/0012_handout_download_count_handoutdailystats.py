@@ -0,0 +1,34 @@
+# Generated by Django 6.0.1 on 2026-10-17 16:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('handouts', '0011_alter_exportjob_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='handout',
+            name='download_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='HandoutDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('downloads', models.PositiveIntegerField(default=0)),
+                ('bytes_served', models.BigIntegerField(default=0)),
+                ('handout', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='handouts.handout')),
+            ],
+            options={
+                'db_table': 'handout_daily_stats',
+                'ordering': ['-date'],
+                'constraints': [models.UniqueConstraint(fields=('handout', 'date'), name='unique_handout_daily_stats')],
+            },
+        ),
+    ]
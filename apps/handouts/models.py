@@ -2,10 +2,10 @@ import uuid
 
 from cloudinary_storage.storage import MediaCloudinaryStorage
 from django.db import models
-from handouts.utils import trigger_storage_email
+from handouts.utils import get_section_render_digest, render_section_html, trigger_storage_email
 from projects.models import Folder, Project
 
-from .enums import SectionLevel
+from .enums import ExportJobKind, ExportJobStatus, SectionLevel
 
 
 def attachment_upload_path(instance, filename):
@@ -21,6 +21,7 @@ class Handout(models.Model):
     description = models.TextField(blank=True)
     file_size = models.BigIntegerField(null=True, blank=True, help_text="Size in bytes")
     last_downloaded_at = models.DateTimeField(null=True, blank=True, help_text="Last PDF generation time")
+    download_count = models.PositiveIntegerField(default=0, editable=False)
     yaml_config = models.JSONField(default=dict, blank=True)
     is_published = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -55,6 +56,8 @@ class Section(models.Model):
 
     title = models.CharField(max_length=255)
     content = models.TextField(help_text="Markdown or Block JSON content", blank=True)
+    rendered_html = models.TextField(blank=True, editable=False, help_text="HTML fragment rendered from content")
+    render_digest = models.CharField(max_length=64, blank=True, editable=False)
     order = models.PositiveIntegerField(default=0)
 
     created_at = models.DateTimeField(auto_now_add=True)
@@ -82,6 +85,13 @@ class Section(models.Model):
             last_order = siblings.aggregate(models.Max("order"))["order__max"]
             self.order = (last_order or 0) + 1
 
+        render_digest = get_section_render_digest(self.content)
+        if render_digest != self.render_digest:
+            self.rendered_html = render_section_html(self.content)
+            self.render_digest = render_digest
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "rendered_html", "render_digest"}
+
         super().save(*args, **kwargs)
 
         self.update_owner_storage_status()
@@ -131,3 +141,41 @@ class Attachment(models.Model):
 
     def __str__(self):
         return f"{self.file_name} (Caption: {self.caption})"
+
+
+class ExportJob(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey("accounts.User", on_delete=models.CASCADE, related_name="export_jobs")
+    handout = models.ForeignKey(Handout, on_delete=models.CASCADE, null=True, blank=True, related_name="export_jobs")
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, null=True, blank=True, related_name="export_jobs")
+    kind = models.CharField(max_length=10, choices=ExportJobKind.choices, default=ExportJobKind.PDF)
+    status = models.CharField(max_length=20, choices=ExportJobStatus.choices, default=ExportJobStatus.PENDING)
+    progress = models.PositiveSmallIntegerField(default=0, help_text="Completion percentage")
+    error = models.TextField(blank=True)
+    artifact_path = models.CharField(max_length=255, blank=True, help_text="Path relative to EXPORT_ARTIFACT_DIR")
+    artifact_name = models.CharField(max_length=255, blank=True, help_text="Download filename")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "export_jobs"
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} export ({self.status})"
+
+
+class HandoutDailyStats(models.Model):
+    handout = models.ForeignKey(Handout, on_delete=models.CASCADE, related_name="daily_stats")
+    date = models.DateField()
+    downloads = models.PositiveIntegerField(default=0)
+    bytes_served = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = "handout_daily_stats"
+        ordering = ["-date"]
+        constraints = [models.UniqueConstraint(fields=["handout", "date"], name="unique_handout_daily_stats")]
+
+    def __str__(self):
+        return f"{self.handout} on {self.date}: {self.downloads}"
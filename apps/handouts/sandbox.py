@@ -0,0 +1,127 @@
+import os
+import pickle
+import resource
+import select
+import signal
+import time
+
+from . import metrics
+
+POLL_INTERVAL = 0.25
+# Headroom over the wall-clock deadline before the kernel's CPU limit kills an orphaned child.
+CPU_LIMIT_GRACE = 5
+
+
+class RenderError(Exception):
+    pass
+
+
+class RenderLimitExceeded(RenderError):
+    limit = None
+
+
+class RenderTimeout(RenderLimitExceeded):
+    limit = "timeout"
+
+
+class RenderMemoryExceeded(RenderLimitExceeded):
+    limit = "memory"
+
+
+class RenderCancelled(RenderError):
+    pass
+
+
+def get_address_space_size():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _apply_limits(timeout, memory_limit):
+    if memory_limit:
+        # The budget sits on top of what the forked worker already maps.
+        ceiling = get_address_space_size() + memory_limit
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (ceiling, ceiling))
+        except (ValueError, OSError):
+            pass
+    if timeout:
+        cpu_seconds = int(timeout) + CPU_LIMIT_GRACE
+        try:
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+        except (ValueError, OSError):
+            pass
+
+
+def _run_child(write_fd, func, args, kwargs, timeout, memory_limit):
+    try:
+        _apply_limits(timeout, memory_limit)
+        with metrics.collect_spans() as spans:
+            payload = ("ok", func(*args, **kwargs), spans)
+    except MemoryError:
+        payload = ("memory", None, [])
+    except BaseException as e:
+        payload = ("error", e, [])
+
+    try:
+        data = pickle.dumps(payload)
+    except Exception:
+        data = pickle.dumps(("error", RenderError(f"{type(payload[1]).__name__}: {payload[1]}"), []))
+    with os.fdopen(write_fd, "wb") as pipe:
+        pipe.write(data)
+
+
+def run_sandboxed(func, *args, timeout=None, memory_limit=None, cancel_check=None, **kwargs):
+    """Call func in a forked child under a wall-clock deadline and an address space ceiling."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            _run_child(write_fd, func, args, kwargs, timeout, memory_limit)
+        finally:
+            os._exit(0)
+
+    os.close(write_fd)
+    deadline = time.monotonic() + timeout if timeout else None
+    chunks = []
+    killed = False
+    try:
+        with os.fdopen(read_fd, "rb", buffering=0) as pipe:
+            while True:
+                if cancel_check and cancel_check():
+                    raise RenderCancelled("Render was cancelled.")
+                wait = POLL_INTERVAL
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise RenderTimeout(f"Render exceeded the {timeout:g}s time limit.")
+                    wait = min(wait, remaining)
+                if select.select([pipe], [], [], wait)[0]:
+                    chunk = pipe.read(1 << 20)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+    except BaseException:
+        os.kill(pid, signal.SIGKILL)
+        killed = True
+        raise
+    finally:
+        _, wait_status = os.waitpid(pid, 0)
+
+    if not chunks:
+        # Allocation failures inside C libraries tend to crash the child rather than raise.
+        if memory_limit and not killed:
+            raise RenderMemoryExceeded(f"Render exceeded the {memory_limit // (1024 * 1024)} MB memory limit.")
+        raise RenderError(f"Renderer exited unexpectedly (status {os.waitstatus_to_exitcode(wait_status)}).")
+
+    kind, value, spans = pickle.loads(b"".join(chunks))
+    if kind == "memory":
+        raise RenderMemoryExceeded(f"Render exceeded the {memory_limit // (1024 * 1024)} MB memory limit.")
+    if kind == "error":
+        raise value
+    metrics.extend_spans(spans)
+    return value
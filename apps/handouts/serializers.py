@@ -1,16 +1,15 @@
+from django.conf import settings
+from django.urls import reverse
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 
-from .models import Attachment, Handout, Section
-
-
-class RecursiveSectionSerializer(serializers.Serializer):
-    def to_representation(self, value):
-        serializer = self.parent.parent.__class__(value, context=self.context)
-        return serializer.data
+from .enums import ExportJobStatus
+from .models import Attachment, ExportJob, Handout, Section
+from .utils import build_section_tree, get_handout_digest, load_section_tree
 
 
 class SectionSerializer(serializers.ModelSerializer):
-    children = RecursiveSectionSerializer(many=True, read_only=True)
+    children = serializers.SerializerMethodField()
 
     class Meta:
         model = Section
@@ -29,6 +28,24 @@ class SectionSerializer(serializers.ModelSerializer):
         read_only_fields = ["level", "order", "children", "created_at", "updated_at"]
         extra_kwargs = {"content": {"allow_blank": True}}
 
+    def get_tree_node(self, obj):
+        trees = self.context.setdefault("section_trees", {})
+        if obj.handout_id not in trees:
+            sections = build_section_tree(Section.objects.filter(handout_id=obj.handout_id))
+            trees[obj.handout_id] = {section.id: section for section in sections}
+        return trees[obj.handout_id].get(obj.id)
+
+    @extend_schema_field(serializers.ListField(child=serializers.DictField()))
+    def get_children(self, obj):
+        children = getattr(obj, "tree_children", None)
+        if children is None:
+            node = self.get_tree_node(obj)
+            children = node.tree_children if node else []
+
+        if self.context.get("flat"):
+            return [str(child.id) for child in children]
+        return SectionSerializer(children, many=True, context=self.context).data
+
     def validate(self, data):
         user = self.context["request"].user
 
@@ -47,7 +64,8 @@ class SectionSerializer(serializers.ModelSerializer):
 
 
 class HandoutSerializer(serializers.ModelSerializer):
-    sections = SectionSerializer(many=True, read_only=True)
+    sections = serializers.SerializerMethodField()
+    thumbnail_urls = serializers.SerializerMethodField()
 
     class Meta:
         model = Handout
@@ -64,8 +82,22 @@ class HandoutSerializer(serializers.ModelSerializer):
             "created_at",
             "updated_at",
             "file_size",
+            "download_count",
+            "thumbnail_urls",
         ]
-        read_only_fields = ["id", "created_at", "updated_at"]
+        read_only_fields = ["id", "created_at", "updated_at", "download_count"]
+
+    @extend_schema_field(SectionSerializer(many=True))
+    def get_sections(self, obj):
+        return SectionSerializer(load_section_tree(obj), many=True, context=self.context).data
+
+    @extend_schema_field(serializers.ListField(child=serializers.URLField()))
+    def get_thumbnail_urls(self, obj):
+        request = self.context.get("request")
+        url = reverse("handout-thumbnail", kwargs={"pk": obj.id})
+        url = request.build_absolute_uri(url) if request else url
+        version = get_handout_digest(obj)[:16]
+        return [f"{url}?page={page}&v={version}" for page in range(settings.PDF_THUMBNAIL_PAGES)]
 
     def validate(self, data):
         project = data.get("project")
@@ -101,3 +133,38 @@ class AttachmentSerializer(serializers.ModelSerializer):
         if (user.get_total_usage() + value.size) > user.storage_limit:
             raise serializers.ValidationError("Uploading this file will exceed your storage limit.")
         return value
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    status_url = serializers.SerializerMethodField()
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExportJob
+        fields = [
+            "id",
+            "kind",
+            "handout",
+            "project",
+            "status",
+            "progress",
+            "error",
+            "artifact_name",
+            "status_url",
+            "download_url",
+            "created_at",
+            "finished_at",
+        ]
+        read_only_fields = fields
+
+    def get_status_url(self, obj):
+        request = self.context.get("request")
+        url = reverse("export-job-detail", kwargs={"pk": obj.id})
+        return request.build_absolute_uri(url) if request else url
+
+    def get_download_url(self, obj):
+        if obj.status != ExportJobStatus.SUCCESS:
+            return None
+        request = self.context.get("request")
+        url = reverse("export-job-download", kwargs={"pk": obj.id})
+        return request.build_absolute_uri(url) if request else url
@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Handout, Section
+from .tasks import schedule_prerender
+
+
+@receiver(post_save, sender=Section)
+@receiver(post_delete, sender=Section)
+def prerender_after_section_change(sender, instance, **kwargs):
+    schedule_prerender(instance.handout_id)
+
+
+@receiver(post_delete, sender=Section)
+def touch_handout_after_section_delete(sender, instance, **kwargs):
+    # The handout's Last-Modified comes from its own and its sections' updated_at, and a deleted
+    # section takes its timestamp with it.
+    Handout.objects.filter(id=instance.handout_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Handout)
+def prerender_after_handout_change(sender, instance, **kwargs):
+    schedule_prerender(instance.id)
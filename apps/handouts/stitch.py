@@ -0,0 +1,45 @@
+import io
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.annotations import Link
+from pypdf.generic import Fit
+
+
+def offset_bookmarks(bookmarks, offset):
+    return [
+        (label, (page + offset, x, y), offset_bookmarks(children, offset), state)
+        for label, (page, x, y), children, state in bookmarks
+    ]
+
+
+def add_outline(writer, bookmarks, parent=None):
+    for label, (page, x, y), children, state in bookmarks:
+        item = writer.add_outline_item(
+            label, page, parent=parent, fit=Fit.xyz(left=x, top=y), is_open=state != "closed"
+        )
+        add_outline(writer, children, parent=item)
+
+
+def stitch_pdfs(paths, bookmarks=(), links=(), target=None, overlay=None):
+    """Concatenate PDF files into one, replacing their outlines with bookmarks and adding cross-file links.
+
+    bookmarks is a WeasyPrint bookmark tree and links are (page, rect, (target_page, x, y)) tuples,
+    all with page indices into the stitched document and coordinates in PDF points. Each page of the
+    overlay PDF, if given, is drawn over the stitched page with the same index.
+    """
+    writer = PdfWriter()
+    for path in paths:
+        # Anchors are unique across files, so each file's named destinations carry over as they are.
+        writer.append(path, import_outline=False)
+    if overlay is not None:
+        for page, stamp in zip(writer.pages, PdfReader(overlay).pages, strict=True):
+            page.merge_page(stamp)
+    add_outline(writer, bookmarks)
+    for page, rect, (target_page, x, y) in links:
+        writer.add_annotation(page, Link(rect=rect, target_page_index=target_page, fit=Fit.xyz(left=x, top=y)))
+
+    if target is None:
+        output = io.BytesIO()
+        writer.write(output)
+        return output.getvalue()
+    writer.write(target)
@@ -0,0 +1,248 @@
+import json
+import logging
+import shutil
+import time
+
+from celery import shared_task
+from celery.signals import worker_init
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .analytics import apply_download_events, drain_download_events, restore_download_events
+from .enums import ExportJobKind, ExportJobStatus
+from .models import ExportJob, Handout, Section
+from .sandbox import RenderCancelled
+from .utils import (
+    generate_handout_pdf,
+    get_section_render_digest,
+    prepare_handout_render,
+    render_handout_pdf,
+    render_handout_to_cache,
+    render_section_html,
+    write_handouts_zip,
+)
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CANCEL_PREFIX = "lectura:export-cancel:"
+EXPORT_CANCEL_TIMEOUT = 24 * 60 * 60
+FLUSH_LOCK_KEY = "lectura:lock:flush-download-events"
+PRERENDER_PREFIX = "lectura:prerender:"
+
+
+@worker_init.connect
+def warm_render_worker(**kwargs):
+    if not settings.PDF_RENDER_WORKER_WARMUP:
+        return
+    # Runs in the pool parent, so every forked (and recycled) child starts with fonts,
+    # Pango and the Markdown extensions already loaded.
+    render_section_html("# Warm-up\n\n```python\nprint(1)\n```\n\n$x^2$")
+    render_handout_pdf(Handout(title="Warm-up"), [], {})
+    logger.info("Render worker warmed up")
+
+
+@shared_task(time_limit=10 * 60, soft_time_limit=9 * 60)
+def render_handout_pdf_task(handout_id, digest=None):
+    handout = Handout.objects.get(id=handout_id)
+    prepared = prepare_handout_render(handout)
+    if digest is not None and prepared[0] != digest:
+        # The handout changed since dispatch; the dispatcher renders the version it asked for.
+        return prepared[0]
+    # The dispatching web process already holds the render lock for this handout.
+    digest, _ = render_handout_to_cache(handout, single_flight=False, prepared=prepared)
+    return digest
+
+
+def _get_prerender_keys(handout_id):
+    return f"{PRERENDER_PREFIX}{handout_id}:last-edit", f"{PRERENDER_PREFIX}{handout_id}:scheduled"
+
+
+def schedule_prerender(handout_id):
+    if not settings.PDF_PRERENDER_ENABLED:
+        return
+    last_edit_key, scheduled_key = _get_prerender_keys(handout_id)
+    timeout = settings.PDF_PRERENDER_DELAY + 5 * 60
+    cache.set(last_edit_key, time.time(), timeout=timeout)
+    # Only the first save of a burst enqueues a render; later saves just push its start back.
+    if cache.add(scheduled_key, 1, timeout=timeout):
+        transaction.on_commit(
+            lambda: prerender_handout.apply_async(args=[str(handout_id)], countdown=settings.PDF_PRERENDER_DELAY)
+        )
+
+
+@shared_task(time_limit=10 * 60, soft_time_limit=9 * 60)
+def prerender_handout(handout_id):
+    last_edit_key, scheduled_key = _get_prerender_keys(handout_id)
+    last_edit = cache.get(last_edit_key)
+    remaining = last_edit + settings.PDF_PRERENDER_DELAY - time.time() if last_edit else 0
+    if remaining > 0:
+        cache.touch(scheduled_key, settings.PDF_PRERENDER_DELAY + 5 * 60)
+        prerender_handout.apply_async(args=[handout_id], countdown=remaining)
+        return f"Deferred: {handout_id}"
+
+    cache.delete(scheduled_key)
+    handout = Handout.objects.select_related("project__owner").filter(id=handout_id).first()
+    if handout is None:
+        return f"Skipped: Handout {handout_id} not found"
+    digest, _ = render_handout_to_cache(handout)
+    return f"Pre-rendered {handout_id}: {digest}"
+
+
+@shared_task(time_limit=2 * 60 * 60, soft_time_limit=2 * 60 * 60 - 60)
+def warm_published_handouts():
+    warmed = 0
+    for handout in Handout.objects.filter(is_published=True).select_related("project__owner").iterator():
+        try:
+            render_handout_to_cache(handout)
+            warmed += 1
+        except Exception as e:
+            logger.error(f"Failed to warm {handout.title}: {str(e)}")
+    return f"Warmed {warmed} published handouts"
+
+
+def _update_progress(job, done, total):
+    job.progress = int(done * 100 / total) if total else 100
+    job.save(update_fields=["progress", "updated_at"])
+
+
+@shared_task(time_limit=30 * 60, soft_time_limit=29 * 60)
+def run_export_job(job_id):
+    try:
+        job = ExportJob.objects.select_related("handout", "project").get(id=job_id)
+    except ExportJob.DoesNotExist:
+        return f"Failed: Export job {job_id} not found"
+    # Conditional updates, so a cancel request is never overwritten by the worker.
+    unfinished = ExportJob.objects.filter(id=job.id).exclude(status=ExportJobStatus.CANCELLED)
+    if not unfinished.update(status=ExportJobStatus.RUNNING, updated_at=timezone.now()):
+        return f"{ExportJobStatus.CANCELLED}: {job.id}"
+    job.status = ExportJobStatus.RUNNING
+
+    artifact_dir = settings.EXPORT_ARTIFACT_DIR
+    artifact_dir.mkdir(parents=True, exist_ok=True)
+
+    def cancel_check():
+        return is_export_cancelled(job.id)
+
+    try:
+        if job.kind == ExportJobKind.ZIP:
+            job.artifact_path = f"{job.id}.zip"
+            with open(artifact_dir / job.artifact_path, "wb") as f:
+                write_handouts_zip(
+                    job.project.handouts.all(),
+                    f,
+                    on_progress=lambda done, total: _update_progress(job, done, total),
+                    cancel_check=cancel_check,
+                )
+        else:
+            job.artifact_path = f"{job.id}.pdf"
+            pdf_path = generate_handout_pdf(job.handout, cancel_check=cancel_check)
+            shutil.copyfile(pdf_path, artifact_dir / job.artifact_path)
+
+        job.status = ExportJobStatus.SUCCESS
+        job.progress = 100
+    except RenderCancelled:
+        logger.info(f"Export job {job.id} cancelled")
+        job.status = ExportJobStatus.CANCELLED
+        (artifact_dir / job.artifact_path).unlink(missing_ok=True)
+    except Exception as e:
+        logger.error(f"Export job {job.id} failed: {str(e)}")
+        job.status = ExportJobStatus.FAILED
+        job.error = str(e)
+
+    job.finished_at = timezone.now()
+    finished = unfinished.update(
+        status=job.status,
+        progress=job.progress,
+        error=job.error,
+        artifact_path=job.artifact_path,
+        finished_at=job.finished_at,
+        updated_at=job.finished_at,
+    )
+    if not finished:
+        # Cancelled after the render stopped checking; drop what it produced.
+        if job.artifact_path:
+            (artifact_dir / job.artifact_path).unlink(missing_ok=True)
+        return f"{ExportJobStatus.CANCELLED}: {job.id}"
+    return f"{job.status}: {job.id}"
+
+
+@shared_task
+def purge_export_artifacts():
+    cutoff = time.time() - settings.EXPORT_ARTIFACT_MAX_AGE
+    purged = 0
+    for path in settings.EXPORT_ARTIFACT_DIR.glob("*"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                purged += 1
+        except FileNotFoundError:
+            continue
+    return f"Purged {purged} export artifacts"
+
+
+@shared_task(time_limit=60 * 60, soft_time_limit=59 * 60)
+def rerender_section_fragments(batch_size=500):
+    stale = []
+    rerendered = 0
+    for section in Section.objects.only("id", "content", "render_digest").iterator(chunk_size=batch_size):
+        render_digest = get_section_render_digest(section.content)
+        if section.render_digest == render_digest:
+            continue
+        section.rendered_html = render_section_html(section.content)
+        section.render_digest = render_digest
+        stale.append(section)
+        if len(stale) >= batch_size:
+            Section.objects.bulk_update(stale, ["rendered_html", "render_digest"])
+            rerendered += len(stale)
+            stale = []
+
+    if stale:
+        Section.objects.bulk_update(stale, ["rendered_html", "render_digest"])
+        rerendered += len(stale)
+    return f"Re-rendered {rerendered} sections"
+
+
+@shared_task(time_limit=10 * 60, soft_time_limit=9 * 60)
+def flush_download_events(batch_size=None):
+    batch_size = batch_size or settings.ANALYTICS_FLUSH_BATCH_SIZE
+    # Overlapping flushes would race on the same daily stats rows.
+    if not cache.add(FLUSH_LOCK_KEY, 1, timeout=10 * 60):
+        return "Skipped: another flush is running"
+
+    flushed = 0
+    try:
+        while True:
+            events = drain_download_events(batch_size)
+            if not events:
+                break
+            try:
+                apply_download_events([json.loads(event) for event in events])
+            except Exception:
+                restore_download_events(events)
+                raise
+            flushed += len(events)
+            if len(events) < batch_size:
+                break
+    finally:
+        cache.delete(FLUSH_LOCK_KEY)
+    return f"Flushed {flushed} download events"
+
+
+def is_export_cancelled(job_id):
+    return bool(cache.get(f"{EXPORT_CANCEL_PREFIX}{job_id}"))
+
+
+def cancel_export_job(job):
+    # The worker polls this flag while the sandboxed render runs and kills it when set.
+    cache.set(f"{EXPORT_CANCEL_PREFIX}{job.id}", True, timeout=EXPORT_CANCEL_TIMEOUT)
+    job.status = ExportJobStatus.CANCELLED
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "finished_at", "updated_at"])
+
+
+def enqueue_export_job(**fields):
+    job = ExportJob.objects.create(**fields)
+    transaction.on_commit(lambda: run_export_job.delay(str(job.id)))
+    return job
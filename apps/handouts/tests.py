@@ -1,10 +1,57 @@
+import io
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+from http.client import HTTPMessage
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+from urllib.error import HTTPError
+
 import pytest
 from accounts.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.template.loader import render_to_string
 from django.urls import reverse
-from handouts.models import Handout
+from django.utils import timezone
+from handouts.analytics import get_download_buffer
+from handouts.cache import LockWaitTimeout, pdf_cache
+from handouts.enums import ExportJobStatus
+from handouts.fetcher import CachingURLFetcher, get_fetcher_stats
+from handouts.highlight import highlight_cache
+from handouts.images import image_cache
+from handouts.latex import math_cache
+from handouts.metrics import get_counters, get_timings
+from handouts.models import ExportJob, Handout, HandoutDailyStats, Section
+from handouts.sandbox import RenderCancelled, RenderMemoryExceeded, RenderTimeout, run_sandboxed
+from handouts.tasks import (
+    cancel_export_job,
+    flush_download_events,
+    prerender_handout,
+    purge_export_artifacts,
+    render_handout_pdf_task,
+    run_export_job,
+    warm_published_handouts,
+)
+from handouts.utils import (
+    _compile_stylesheet,
+    build_render_context,
+    generate_handout_pdf,
+    get_markdown_engine,
+    get_stylesheet_css,
+    get_stylesheet_path,
+    render_handout_to_cache,
+    render_page_numbers,
+    render_section_html,
+)
+from PIL import Image
 from projects.models import Project
+from pypdf import PdfReader
 from rest_framework import status
 from rest_framework.test import APIClient
+from weasyprint.urls import URLFetchingError
 
 
 @pytest.fixture
@@ -18,6 +65,21 @@ def auth_user(db):
     return User.objects.create_user(username="editor@example.com", email="editor@example.com", password="password123")
 
 
+@pytest.fixture(autouse=True)
+def render_cache(settings, tmp_path):
+    settings.PDF_CACHE_DIR = tmp_path / "pdf"
+    settings.EXPORT_ARTIFACT_DIR = tmp_path / "exports"
+    settings.MATH_CACHE_DIR = tmp_path / "math"
+    settings.PDF_FETCH_CACHE_DIR = tmp_path / "assets"
+    settings.PDF_THUMBNAIL_CACHE_DIR = tmp_path / "thumbnails"
+    settings.CODE_HIGHLIGHT_CACHE_DIR = tmp_path / "highlight"
+    settings.PDF_IMAGE_CACHE_DIR = tmp_path / "images"
+    # Renders stay in process so tests can patch and inspect them; the sandbox has its own tests.
+    settings.PDF_RENDER_SANDBOX_ENABLED = False
+    cache.clear()
+    get_download_buffer.cache_clear()
+
+
 @pytest.mark.django_db
 class TestHandouts:
     def test_handout_pdf_generation_endpoint(self, api_client, auth_user):
@@ -34,3 +96,667 @@ class TestHandouts:
         response = api_client.get(url)
         assert response.status_code == status.HTTP_200_OK
         assert response["Content-Type"] == "application/pdf"
+
+    def test_repeat_export_is_served_from_cache(self, api_client, auth_user):
+        api_client.force_authenticate(user=auth_user)
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Cached")
+        Section.objects.create(handout=handout, title="Intro", content="Hello **world**")
+        url = reverse("handout-export-pdf", kwargs={"pk": handout.id})
+
+        first = api_client.get(url)
+        second = api_client.get(url)
+
+        assert b"".join(first.streaming_content) == b"".join(second.streaming_content)
+        assert pdf_cache.stats() == {"hits": 1, "misses": 1, "evictions": 0}
+
+        # A new section renderer invalidates the cached PDF along with the fragments.
+        with patch("handouts.utils.SECTION_RENDERER_VERSION", "next"):
+            third = api_client.get(url)
+        assert third["ETag"] != first["ETag"]
+        assert pdf_cache.stats()["misses"] == 2
+
+    def test_export_reports_server_timing(self, api_client, auth_user):
+        api_client.force_authenticate(user=auth_user)
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Timed")
+        Section.objects.create(handout=handout, title="Intro", content="Hello")
+
+        response = api_client.get(reverse("handout-export-pdf", kwargs={"pk": handout.id}))
+
+        stages = [entry.split(";")[0] for entry in response["Server-Timing"].split(", ")]
+        assert stages == [
+            "config",
+            "sections",
+            "markdown",
+            "digest",
+            "cache",
+            "template",
+            "stylesheet",
+            "layout",
+            "write_pdf",
+        ]
+        assert get_timings("render.layout")["render.layout"]["count"] == 1
+
+    def test_export_is_delegated_to_render_pool(self, api_client, auth_user, settings):
+        settings.PDF_RENDER_POOL_ENABLED = True
+        api_client.force_authenticate(user=auth_user)
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Pooled")
+
+        def send_task(name, args, queue):
+            return MagicMock(get=MagicMock(return_value=render_handout_pdf_task(*args)))
+
+        with patch("handouts.utils.current_app") as app:
+            app.send_task.side_effect = send_task
+            response = api_client.get(reverse("handout-export-pdf", kwargs={"pk": handout.id}))
+            api_client.get(reverse("handout-export-pdf", kwargs={"pk": handout.id}))
+
+        assert response.status_code == status.HTTP_200_OK
+        digest = response["ETag"].strip('"')
+        app.send_task.assert_called_once_with(
+            "handouts.tasks.render_handout_pdf_task", args=[str(handout.id), digest], queue="render"
+        )
+
+        # An edit landing before the worker loads the handout is not cached under the older digest.
+        handout.title = "Renamed"
+        handout.save()
+
+        def send_task_after_edit(name, args, queue):
+            Handout.objects.filter(id=handout.id).update(title="Renamed again")
+            return send_task(name, args, queue)
+
+        with patch("handouts.utils.current_app") as app:
+            app.send_task.side_effect = send_task_after_edit
+            renamed = api_client.get(reverse("handout-export-pdf", kwargs={"pk": handout.id}))
+        assert renamed.status_code == status.HTTP_200_OK
+        assert pdf_cache.path_for(renamed["ETag"].strip('"')).exists()
+        assert len(list(settings.PDF_CACHE_DIR.glob("*/*.pdf"))) == 2
+
+    def test_section_html_is_rendered_on_content_change(self, auth_user):
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Fragments")
+        section = Section.objects.create(handout=handout, title="Intro", content="Hello **world**")
+        assert "<strong>world</strong>" in section.rendered_html
+
+        digest = section.render_digest
+        section.order = 5
+        section.save()
+        assert section.render_digest == digest
+
+        section.content = "Goodbye"
+        section.save(update_fields=["content"])
+        section.refresh_from_db()
+        assert section.render_digest != digest
+        assert "Goodbye" in section.rendered_html
+
+    def test_cache_eviction_does_not_rescan_on_every_write(self, settings):
+        settings.MATH_CACHE_MAX_BYTES = 1000
+        with patch.object(math_cache, "evict", wraps=math_cache.evict) as evict:
+            for index in range(200):
+                math_cache.set(f"{index:064x}", b"x" * 10)
+
+        assert evict.call_count <= 15
+        assert sum(path.stat().st_size for path in settings.MATH_CACHE_DIR.glob("*/*.svg")) <= 1000
+        assert math_cache.stats()["evictions"] > 0
+
+    def test_math_is_rendered_offline(self, auth_user):
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Math")
+        section = Section.objects.create(
+            handout=handout, title="Formulas", content="Inline $x^2$ twice $x^2$.\n\n$$\\frac{a}{b}$$"
+        )
+
+        assert "codecogs" not in section.rendered_html
+        assert section.rendered_html.count("data:image/svg+xml;base64,") == 3
+        assert 'class="math-block"' in section.rendered_html
+        assert math_cache.stats()["misses"] == 2
+
+    def test_markdown_extensions_skip_code_and_add_icons(self, auth_user):
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Extensions")
+        section = Section.objects.create(
+            handout=handout, title="Notes", content="Costs `$5` or `$10`.\n\n/// warning\nCareful\n///"
+        )
+
+        assert "<code>$5</code>" in section.rendered_html
+        assert "math-inline" not in section.rendered_html
+        assert '<p class="admonition-title"><span class="admonition-icon"><svg' in section.rendered_html
+
+    def test_math_leaves_prose_and_code_spans_intact(self):
+        between = render_section_html("$$x$$ is nice.\n\nSome text here.\n\n$$y$$")
+        assert "is nice." in between
+        assert "<p>Some text here.</p>" in between
+        assert between.count("data:image/svg+xml;base64,") == 2
+
+        mixed = render_section_html("Cost is $5 and `$x$` code and $a^2$ ok")
+        assert "<code>$x$</code>" in mixed
+        assert "klzzwxh" not in mixed
+        assert "math-error" not in mixed
+        assert mixed.count("data:image/svg+xml;base64,") == 1
+
+    def test_code_highlighting_is_cached_across_sections(self):
+        content = "```\nimport os\nprint(os.sep)\n```\n\n    :::javascript\n    const a = 1;"
+        first = render_section_html(content)
+
+        with patch("handouts.highlight.highlight") as pygments_highlight:
+            second = render_section_html(content)
+
+        pygments_highlight.assert_not_called()
+        assert second == first
+        assert '<span class="kn">import</span>' in first
+        assert '<span class="kd">const</span>' in first
+        assert highlight_cache.stats() == {"hits": 2, "misses": 2, "evictions": 0}
+
+    def test_markdown_engine_is_reused_without_leaking_state(self):
+        content = "# Intro\n\nText[^1] and $x$.\n\n[^1]: Note"
+        first = render_section_html(content)
+
+        assert get_markdown_engine() is get_markdown_engine()
+        assert render_section_html(content) == first
+        assert 'id="intro"' in first
+
+    def test_preview_html_revalidates_with_etag(self, api_client, auth_user):
+        api_client.force_authenticate(user=auth_user)
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Preview")
+        intro = Section.objects.create(handout=handout, title="Intro", content="Hello **world**")
+        Section.objects.create(handout=handout, title="Outro", content="Bye", order=1)
+        url = reverse("handout-preview-html", kwargs={"pk": handout.id})
+
+        with patch("handouts.utils.HTML") as html:
+            response = api_client.get(url)
+        html.assert_not_called()
+        assert response.status_code == status.HTTP_200_OK
+        assert "<strong>world</strong>" in response.content.decode()
+        assert 'class="cover-page"' in response.content.decode()
+        assert response["Content-Security-Policy"] == "sandbox"
+        assert response["X-Content-Type-Options"] == "nosniff"
+
+        cached = api_client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        assert cached.status_code == status.HTTP_304_NOT_MODIFIED
+
+        single = api_client.get(url, {"section": str(intro.id)})
+        assert single["ETag"] != response["ETag"]
+        assert "Bye" not in single.content.decode()
+        assert 'class="cover-page"' not in single.content.decode()
+
+    def test_section_pdf_renders_only_the_chosen_subtree(self, api_client, auth_user):
+        api_client.force_authenticate(user=auth_user)
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Subtree")
+        chapter = Section.objects.create(handout=handout, title="Chapter")
+        Section.objects.create(handout=handout, parent=chapter, title="Child", content="Nested")
+        Section.objects.create(handout=handout, title="Other", content="Elsewhere", order=1)
+        url = reverse("handout-export-pdf", kwargs={"pk": handout.id})
+
+        with patch("handouts.utils.render_to_string", wraps=render_to_string) as render:
+            response = api_client.get(url, {"section": str(chapter.id), "subtree": "true"})
+        context = next(c.args[1] for c in render.call_args_list if c.args[0] == "pdf/handout_template.html")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [s["title"] for s in context["sections"]] == ["Chapter", "Child"]
+        assert context["show_front_matter"] is False
+        assert api_client.get(url, {"section": str(handout.id)}).status_code == status.HTTP_404_NOT_FOUND
+
+    def test_cover_page_style_follows_front_matter(self, auth_user):
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Cover")
+
+        for show_front_matter in (True, False):
+            _, stylesheet_context = build_render_context(handout, [], {}, show_front_matter=show_front_matter)
+            assert ("@page:first" in get_stylesheet_css(stylesheet_context)) is show_front_matter
+
+    def test_thumbnails_are_cached_per_revision(self, api_client, auth_user):
+        api_client.force_authenticate(user=auth_user)
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Thumbs")
+        buffer = io.BytesIO()
+        pages = [Image.new("RGB", (595, 842), color) for color in ("white", "gray")]
+        pages[0].save(buffer, format="PDF", save_all=True, append_images=pages[1:])
+
+        def render_pdf(handout, sections, user_config, show_front_matter, target):
+            Path(target).write_bytes(buffer.getvalue())
+
+        with patch("handouts.utils.render_handout_pdf", side_effect=render_pdf) as render:
+            detail = api_client.get(reverse("handout-detail", kwargs={"pk": handout.id}))
+            cover_url, page_url, missing_url = detail.data["thumbnail_urls"]
+            cover = api_client.get(cover_url)
+            api_client.get(page_url)
+            missing = api_client.get(missing_url)
+
+            handout.title = "Renamed"
+            handout.save()
+            renamed = api_client.get(reverse("handout-detail", kwargs={"pk": handout.id}))
+            stale = api_client.get(cover_url)
+
+        assert cover.status_code == status.HTTP_200_OK
+        assert cover["Content-Type"] == "image/png"
+        assert "immutable" in cover["Cache-Control"]
+        assert Image.open(io.BytesIO(b"".join(cover.streaming_content))).width == 320
+        assert missing.status_code == status.HTTP_404_NOT_FOUND
+        assert renamed.data["thumbnail_urls"][0] != cover_url
+        assert "no-cache" in stale["Cache-Control"]
+        assert render.call_count == 2
+
+    def test_benchmark_command_reports_every_stage(self, tmp_path):
+        output = tmp_path / "bench.json"
+        call_command("benchmark_render", sections=4, images=1, iterations=2, memory=True, output=str(output))
+
+        report = json.loads(output.read_text())
+        assert list(report["stages"]) == ["markdown", "template", "stylesheet", "layout", "write_pdf"]
+        assert len(report["stages"]["layout"]["seconds"]) == 2
+        assert report["stages"]["markdown"]["peak_kb"]
+        assert report["pdf_bytes"] > 0
+        assert not Section.objects.exists()
+
+    def test_large_handouts_are_rendered_in_chunks(self, auth_user, settings):
+        settings.PDF_CHUNKED_RENDER_MIN_HTML_SIZE = 1
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Book")
+        for order in range(2):
+            chapter = Section.objects.create(handout=handout, title=f"Chapter {order + 1}", content="Text", order=order)
+            Section.objects.create(handout=handout, parent=chapter, title=f"Part {order + 1}.1", content="More")
+
+        with (
+            patch("handouts.utils.render_to_string", wraps=render_to_string) as render,
+            patch("handouts.utils.render_page_numbers", wraps=render_page_numbers) as number,
+        ):
+            _, path = render_handout_to_cache(handout)
+        contexts = [c.args[1] for c in render.call_args_list if c.args[0] == "pdf/handout_template.html"]
+        reader = PdfReader(path)
+        chapters = {item.title: reader.get_destination_page_number(item) for item in reader.outline if "/Title" in item}
+        toc_targets = [
+            reader.get_page_number(annot.get_object()["/Dest"][0].get_object()) for annot in reader.pages[1]["/Annots"]
+        ]
+
+        # Front matter and two chapters, each laid out once, then numbered together from blank pages.
+        assert len(contexts) == 3
+        assert number.call_args.args[2:4] == (True, 4)
+        assert [s["anchor"] for s in contexts[-1]["sections"]] == ["section-3", "section-4"]
+        assert len(reader.pages) == 4
+        assert {title: chapters[title] for title in ("Chapter 1", "Chapter 2")} == {"Chapter 1": 2, "Chapter 2": 3}
+        assert toc_targets == [2, 2, 3, 3]
+
+    def test_stylesheet_is_compiled_once_per_variant(self, auth_user):
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        first = Handout.objects.create(project=project, title="First", yaml_config={"theme": "nordic_dark"})
+        second = Handout.objects.create(project=project, title="Second", yaml_config={"theme": "nordic_dark"})
+        other = Handout.objects.create(project=project, title="Other", yaml_config={"indent_mode": "all"})
+        _compile_stylesheet.cache_clear()
+
+        render_handout_to_cache(first)
+        render_handout_to_cache(second)
+        assert _compile_stylesheet.cache_info().misses == 1
+        assert _compile_stylesheet.cache_info().hits == 1
+
+        render_handout_to_cache(other)
+        assert _compile_stylesheet.cache_info().misses == 2
+
+    def test_fetcher_caches_and_revalidates_remote_assets(self):
+        url = "https://res.cloudinary.com/demo/figure.png"
+        headers = HTTPMessage()
+        headers["Content-Type"] = "image/png"
+        headers["ETag"] = '"v1"'
+        headers["Cache-Control"] = "max-age=0"
+        response = MagicMock(url=url, headers=headers)
+        response.__enter__.return_value = response
+        response.read.return_value = b"png-bytes"
+        fetcher = CachingURLFetcher()
+
+        with patch("handouts.fetcher.urlopen", return_value=response):
+            assert fetcher(url)["string"] == b"png-bytes"
+
+        not_modified = HTTPError(url, 304, "Not Modified", HTTPMessage(), None)
+        with patch("handouts.fetcher.urlopen", side_effect=not_modified) as urlopen:
+            result = fetcher(url)
+        assert result["string"] == b"png-bytes"
+        assert result["mime_type"] == "image/png"
+        assert urlopen.call_args.args[0].get_header("If-none-match") == '"v1"'
+
+        with patch("handouts.fetcher.urlopen", side_effect=TimeoutError("timed out")):
+            assert fetcher(url)["string"] == b"png-bytes"
+
+        stats = get_fetcher_stats()
+        assert (stats["downloaded"], stats["revalidated"], stats["stale_served"]) == (1, 1, 1)
+
+    def test_fetcher_rejects_oversized_remote_responses(self, settings):
+        settings.PDF_REMOTE_FETCH_MAX_BYTES = 10
+        url = "https://res.cloudinary.com/demo/huge.png"
+        headers = HTTPMessage()
+        headers["Content-Type"] = "image/png"
+        response = MagicMock(url=url, headers=headers)
+        response.__enter__.return_value = response
+        response.read.side_effect = io.BytesIO(b"x" * 1000).read
+
+        with patch("handouts.fetcher.urlopen", return_value=response), pytest.raises(URLFetchingError):
+            CachingURLFetcher()(url)
+        response.read.assert_called_once_with(11)
+
+        headers["Content-Length"] = "1000"
+        with patch("handouts.fetcher.urlopen", return_value=response), pytest.raises(URLFetchingError):
+            CachingURLFetcher()(url)
+        response.read.assert_called_once()
+
+    def test_fetcher_embeds_downscaled_image_variants(self, settings, tmp_path):
+        settings.PDF_IMAGE_DPI = 100
+        photo, icon = tmp_path / "photo.jpg", tmp_path / "icon.png"
+        Image.new("RGB", (3000, 2000), "teal").save(photo)
+        Image.new("RGBA", (200, 200), "teal").save(icon)
+        fetcher = CachingURLFetcher()
+
+        first = fetcher(photo.as_uri())
+        second = fetcher(photo.as_uri())
+        small = fetcher(icon.as_uri())
+
+        assert first["mime_type"] == "image/jpeg"
+        assert "path" not in first
+        assert Image.open(io.BytesIO(first["string"])).size == (630, 420)
+        assert second["string"] == first["string"]
+        assert image_cache.stats()["hits"] == 1
+        assert small["string"] == icon.read_bytes()
+
+    def test_section_tree_is_loaded_in_one_query(self, api_client, auth_user, django_assert_max_num_queries):
+        api_client.force_authenticate(user=auth_user)
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Tree")
+        for i in range(5):
+            chapter = Section.objects.create(handout=handout, title=f"Chapter {i}")
+            for j in range(3):
+                part = Section.objects.create(handout=handout, parent=chapter, title=f"Part {i}.{j}")
+                Section.objects.create(handout=handout, parent=part, title=f"Detail {i}.{j}")
+
+        with django_assert_max_num_queries(5):
+            response = api_client.get(reverse("handout-detail", kwargs={"pk": handout.id}))
+
+        sections = response.data["sections"]
+        assert [s["title"] for s in sections[:4]] == ["Chapter 0", "Part 0.0", "Detail 0.0", "Part 0.1"]
+        assert sections[0]["children"][0]["children"][0]["title"] == "Detail 0.0"
+
+        with django_assert_max_num_queries(5):
+            response = api_client.get(
+                reverse("section-list"), {"handout": handout.id, "level": "section", "flat": "true"}
+            )
+        chapters = {s["title"]: s for s in response.data["results"]}
+        assert chapters["Chapter 0"]["children"] == [s["id"] for s in sections[0]["children"]]
+
+    def test_async_export_job_flow(self, api_client, auth_user, django_capture_on_commit_callbacks):
+        api_client.force_authenticate(user=auth_user)
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Async")
+        url = reverse("handout-export-pdf", kwargs={"pk": handout.id})
+
+        with patch("handouts.tasks.run_export_job.delay") as delay:
+            with django_capture_on_commit_callbacks(execute=True):
+                response = api_client.get(url, {"async": "true"})
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.data["download_url"] is None
+        delay.assert_called_once_with(str(response.data["id"]))
+
+        run_export_job(response.data["id"])
+        job = ExportJob.objects.get(id=response.data["id"])
+        assert job.status == ExportJobStatus.SUCCESS
+
+        status_response = api_client.get(reverse("export-job-detail", kwargs={"pk": job.id}))
+        assert status_response.data["progress"] == 100
+
+        download = api_client.get(status_response.data["download_url"])
+        assert download.status_code == status.HTTP_200_OK
+        assert download["Content-Type"] == "application/pdf"
+
+    def test_export_job_can_be_cancelled(self, api_client, auth_user, settings):
+        api_client.force_authenticate(user=auth_user)
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Cancelled")
+        job = ExportJob.objects.create(owner=auth_user, handout=handout)
+
+        response = api_client.post(reverse("export-job-cancel", kwargs={"pk": job.id}))
+        assert response.data["status"] == ExportJobStatus.CANCELLED
+
+        run_export_job(str(job.id))
+        job.refresh_from_db()
+        assert job.status == ExportJobStatus.CANCELLED
+        assert api_client.post(reverse("export-job-cancel", kwargs={"pk": job.id})).status_code == 409
+
+        # A cancel that lands after the render stopped polling still wins over the finished render.
+        late = ExportJob.objects.create(owner=auth_user, handout=handout)
+
+        def render_then_cancel(handout, cancel_check=None):
+            path = generate_handout_pdf(handout)
+            cancel_export_job(late)
+            return path
+
+        with patch("handouts.tasks.generate_handout_pdf", side_effect=render_then_cancel):
+            run_export_job(str(late.id))
+        late.refresh_from_db()
+        assert late.status == ExportJobStatus.CANCELLED
+        assert not (settings.EXPORT_ARTIFACT_DIR / f"{late.id}.pdf").exists()
+
+    def test_expired_export_artifacts_are_purged(self, api_client, auth_user, settings):
+        api_client.force_authenticate(user=auth_user)
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        job = ExportJob.objects.create(owner=auth_user, handout=Handout.objects.create(project=project, title="Old"))
+        run_export_job(str(job.id))
+        artifact = settings.EXPORT_ARTIFACT_DIR / f"{job.id}.pdf"
+        expired = time.time() - settings.EXPORT_ARTIFACT_MAX_AGE - 60
+        os.utime(artifact, (expired, expired))
+
+        purge_export_artifacts()
+
+        assert not artifact.exists()
+        download = api_client.get(reverse("export-job-download", kwargs={"pk": job.id}))
+        assert download.status_code == status.HTTP_410_GONE
+
+    def test_sandbox_enforces_deadline_memory_and_cancellation(self):
+        assert run_sandboxed(len, "abc", timeout=5, memory_limit=256 * 1024 * 1024) == 3
+        with pytest.raises(RenderTimeout):
+            run_sandboxed(time.sleep, 5, timeout=0.2)
+        with pytest.raises(RenderMemoryExceeded):
+            run_sandboxed(bytearray, 1024 * 1024 * 1024, memory_limit=64 * 1024 * 1024)
+        with pytest.raises(RenderCancelled):
+            run_sandboxed(time.sleep, 5, cancel_check=lambda: True)
+        with pytest.raises(ZeroDivisionError):
+            run_sandboxed(divmod, 1, 0)
+
+    def test_export_reports_render_limits(self, api_client, auth_user, settings):
+        settings.PDF_RENDER_SANDBOX_ENABLED = True
+        api_client.force_authenticate(user=auth_user)
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Slow")
+
+        with patch(
+            "handouts.utils.run_sandboxed", side_effect=RenderTimeout("Render exceeded the 60s time limit.")
+        ) as run:
+            response = api_client.get(reverse("handout-export-pdf", kwargs={"pk": handout.id}))
+
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert response.data["limit"] == "timeout"
+        assert run.call_args.kwargs["timeout"] == auth_user.render_limits["timeout"]
+
+    def test_concurrent_renders_are_coalesced(self):
+        renders = []
+
+        def render(target):
+            renders.append(1)
+            time.sleep(0.5)
+            Path(target).write_bytes(b"%PDF-shared")
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(pdf_cache.get_or_create_path("a" * 64, render, lock_timeout=30))
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(renders) == 1
+        assert [path.read_bytes() for path in results] == [b"%PDF-shared"] * 5
+        assert get_counters("pdf_cache.coalesced")["pdf_cache.coalesced"] == 4
+
+    def test_failed_render_is_shared_with_waiters(self):
+        renders, errors = [], []
+
+        def render(target):
+            renders.append(1)
+            time.sleep(0.5)
+            raise RenderTimeout("Render exceeded the 60s time limit.")
+
+        def fetch():
+            try:
+                pdf_cache.get_or_create_path("b" * 64, render, lock_timeout=30, failure_ttl=30)
+            except RenderTimeout as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=fetch) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(renders) == 1
+        assert len(errors) == 5
+
+        cache.add("lectura:lock:pdf:" + "c" * 64, "held", timeout=30)
+        with pytest.raises(LockWaitTimeout):
+            pdf_cache.get_or_create_path("c" * 64, render, lock_timeout=30, wait_timeout=0.3)
+
+    def test_export_supports_conditional_and_range_requests(self, api_client, auth_user):
+        api_client.force_authenticate(user=auth_user)
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Conditional")
+        Section.objects.create(handout=handout, title="Intro", content="Hello")
+        url = reverse("handout-export-pdf", kwargs={"pk": handout.id})
+
+        first = api_client.get(url)
+        assert first["Accept-Ranges"] == "bytes"
+        pdf_content = b"".join(first.streaming_content)
+        flush_download_events()
+        handout.refresh_from_db()
+        downloaded_at = handout.last_downloaded_at
+
+        with patch("handouts.views.generate_handout_pdf") as generate:
+            not_modified = api_client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+            since = api_client.get(url, HTTP_IF_MODIFIED_SINCE=first["Last-Modified"])
+        assert not_modified.status_code == since.status_code == status.HTTP_304_NOT_MODIFIED
+        generate.assert_not_called()
+        flush_download_events()
+        handout.refresh_from_db()
+        assert handout.last_downloaded_at == downloaded_at
+
+        partial = api_client.get(url, HTTP_RANGE="bytes=4-9")
+        assert partial.status_code == status.HTTP_206_PARTIAL_CONTENT
+        assert partial.content == pdf_content[4:10]
+        assert partial["Content-Range"] == f"bytes 4-9/{len(pdf_content)}"
+        assert api_client.get(url, HTTP_RANGE="bytes=-5").content == pdf_content[-5:]
+        assert api_client.get(url, HTTP_RANGE="bytes=4-9", HTTP_IF_RANGE='"stale"').status_code == 200
+        unsatisfiable = api_client.get(url, HTTP_RANGE=f"bytes={len(pdf_content)}-")
+        assert unsatisfiable.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+
+    def test_last_modified_follows_stylesheet_changes_and_deletes(self, api_client, auth_user, tmp_path):
+        api_client.force_authenticate(user=auth_user)
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Versions")
+        Section.objects.create(handout=handout, title="Intro", content="Hello")
+        extra = Section.objects.create(handout=handout, title="Extra", content="Bye", order=1)
+        url = reverse("handout-export-pdf", kwargs={"pk": handout.id})
+        first = api_client.get(url)
+        later = timezone.now() + timedelta(minutes=5)
+
+        # A stylesheet or template edit leaves the rows untouched.
+        stylesheet = tmp_path / "handout_style.css"
+        stylesheet.write_text(Path(get_stylesheet_path()).read_text() + "\nh1 { color: red; }")
+        os.utime(stylesheet, (later.timestamp(), later.timestamp()))
+        with patch("handouts.utils.get_stylesheet_path", return_value=str(stylesheet)):
+            restyled = api_client.get(url, HTTP_IF_MODIFIED_SINCE=first["Last-Modified"])
+        with patch("django.utils.timezone.now", return_value=later + timedelta(minutes=5)):
+            extra.delete()
+        deleted = api_client.get(url, HTTP_IF_MODIFIED_SINCE=restyled["Last-Modified"])
+
+        assert restyled.status_code == status.HTTP_200_OK
+        assert deleted.status_code == status.HTTP_200_OK
+
+    def test_export_redirects_to_signed_download(self, api_client, auth_user, settings):
+        settings.PDF_DOWNLOAD_MODE = "redirect"
+        api_client.force_authenticate(user=auth_user)
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Signed")
+
+        response = api_client.get(reverse("handout-export-pdf", kwargs={"pk": handout.id}))
+        assert response.status_code == status.HTTP_302_FOUND
+
+        api_client.force_authenticate(user=None)
+        download = api_client.get(response["Location"])
+        assert download.status_code == status.HTTP_200_OK
+        assert b"".join(download.streaming_content).startswith(b"%PDF")
+        assert api_client.get(response["Location"].replace("downloads/", "downloads/x")).status_code == 404
+
+    def test_downloads_are_written_through_without_a_buffer(self, api_client, auth_user):
+        api_client.force_authenticate(user=auth_user)
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Popular")
+        updated_at = handout.updated_at
+
+        for _ in range(2):
+            api_client.get(reverse("handout-export-pdf", kwargs={"pk": handout.id}))
+        handout.refresh_from_db()
+
+        assert handout.download_count == 2
+        assert handout.file_size > 0
+        assert handout.last_downloaded_at is not None
+        assert handout.updated_at == updated_at
+        stats = HandoutDailyStats.objects.get(handout=handout)
+        assert (stats.downloads, stats.bytes_served) == (2, 2 * handout.file_size)
+
+    def test_buffered_downloads_are_flushed_in_batches(self, api_client, auth_user, settings):
+        settings.ANALYTICS_BUFFER_URL = "redis://analytics"
+        api_client.force_authenticate(user=auth_user)
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        handout = Handout.objects.create(project=project, title="Popular")
+        url = reverse("handout-export-pdf", kwargs={"pk": handout.id})
+        client = MagicMock()
+
+        with patch("handouts.analytics.redis.Redis.from_url", return_value=client):
+            for _ in range(3):
+                api_client.get(url)
+        handout.refresh_from_db()
+        assert handout.download_count == 0
+
+        events = [c.args[1] for c in client.rpush.call_args_list]
+        client.pipeline.return_value.execute.side_effect = [(events[:2], True), (events[2:], True)]
+        assert flush_download_events(batch_size=2) == "Flushed 3 download events"
+        handout.refresh_from_db()
+        assert handout.download_count == 3
+        stats = HandoutDailyStats.objects.get(handout=handout)
+        assert (stats.downloads, stats.bytes_served) == (3, 3 * handout.file_size)
+
+    def test_saves_schedule_one_debounced_prerender(self, auth_user, settings, django_capture_on_commit_callbacks):
+        settings.PDF_PRERENDER_ENABLED = True
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        with patch("handouts.tasks.prerender_handout.apply_async") as apply_async:
+            with django_capture_on_commit_callbacks(execute=True):
+                handout = Handout.objects.create(project=project, title="Draft")
+                section = Section.objects.create(handout=handout, title="Intro", content="Hello")
+                section.content = "Hello again"
+                section.save()
+            apply_async.assert_called_once_with(args=[str(handout.id)], countdown=settings.PDF_PRERENDER_DELAY)
+
+            assert prerender_handout(str(handout.id)).startswith("Deferred")
+            assert apply_async.call_count == 2
+
+        settings.PDF_PRERENDER_DELAY = 0
+        digest = prerender_handout(str(handout.id)).rsplit(" ", 1)[1]
+        assert pdf_cache.path_for(digest).exists()
+
+    def test_nightly_warmup_renders_published_handouts(self, auth_user):
+        project = Project.objects.create(name="Handout Project", owner=auth_user)
+        Handout.objects.create(project=project, title="Published", is_published=True)
+        Handout.objects.create(project=project, title="Draft")
+
+        with patch("handouts.tasks.render_handout_to_cache") as render:
+            assert warm_published_handouts() == "Warmed 1 published handouts"
+        assert render.call_args.args[0].title == "Published"
@@ -0,0 +1,29 @@
+import io
+
+import pypdfium2 as pdfium
+from django.conf import settings
+
+from .cache import FileCache
+
+thumbnail_cache = FileCache("thumbnail", "PDF_THUMBNAIL_CACHE_DIR", "PDF_THUMBNAIL_CACHE_MAX_BYTES", suffix=".png")
+
+
+def get_thumbnail_key(digest, page):
+    return f"{digest}-{settings.PDF_THUMBNAIL_WIDTH}-{page}"
+
+
+def render_pdf_thumbnails(pdf, pages, width):
+    """Rasterize the first pages of a PDF, given as bytes or a path."""
+    document = pdfium.PdfDocument(pdf)
+    try:
+        thumbnails = []
+        for index in range(min(pages, len(document))):
+            page = document[index]
+            bitmap = page.render(scale=width / page.get_width())
+            buffer = io.BytesIO()
+            bitmap.to_pil().save(buffer, format="PNG", optimize=True)
+            thumbnails.append(buffer.getvalue())
+            page.close()
+        return thumbnails
+    finally:
+        document.close()
@@ -1,13 +1,15 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import AttachmentViewSet, HandoutViewSet, SectionViewSet
+from .views import AttachmentViewSet, ExportJobViewSet, HandoutViewSet, SectionViewSet, SignedPDFDownloadView
 
 router = DefaultRouter()
 router.register(r"handouts", HandoutViewSet, basename="handout")
 router.register(r"sections", SectionViewSet, basename="section")
 router.register(r"attachments", AttachmentViewSet, basename="attachment")
+router.register(r"export-jobs", ExportJobViewSet, basename="export-job")
 
 urlpatterns = [
+    path("downloads/<str:token>/", SignedPDFDownloadView.as_view(), name="handout-pdf-download"),
     path("", include(router.urls)),
 ]
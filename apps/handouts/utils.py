@@ -1,64 +1,164 @@
+import functools
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
-import re
-import urllib.parse
-from datetime import datetime
-
+import random
+import shutil
+import tempfile
+import threading
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import UTC, datetime
+
+import django
 import markdown
+import weasyprint
 import yaml
+from celery import current_app
 from django.conf import settings
 from django.template.loader import render_to_string
 from django.utils import timezone
 from letters.models import EmailTemplate, Letter
 from letters.tasks import send_letter_task
-from weasyprint import HTML
+from weasyprint import CSS, HTML
+from weasyprint.text.fonts import FontConfiguration
+
+from . import analytics, metrics
+from .cache import pdf_cache
+from .fetcher import CachingURLFetcher
+from .highlight import HIGHLIGHT_RENDERER_VERSION
+from .images import IMAGE_VARIANT_VERSION
+from .latex import MATH_RENDERER_VERSION
+from .sandbox import RenderCancelled, run_sandboxed
+from .stitch import offset_bookmarks, stitch_pdfs
+from .theme import FONT_MAP, THEME_DEFAULTS, get_language_config
+from .thumbnails import get_thumbnail_key, render_pdf_thumbnails, thumbnail_cache
+
+# Bump whenever a change to the rendering code alters the produced PDF.
+RENDERER_VERSION = "3"
+PDF_TEMPLATE_NAME = "pdf/handout_template.html"
+PDF_STYLESHEET_TEMPLATE_NAME = "pdf/handout_stylesheet.css"
+PDF_CHUNK_STYLESHEET_TEMPLATE_NAME = "pdf/handout_chunk_stylesheet.css"
+# Page number sheets are stamped over content pages, so they must stay transparent.
+PAGE_NUMBER_SHEET_CSS = """
+@page { background: none; }
+html, body { background: none; }
+.page-number-sheet + .page-number-sheet { break-before: page; }
+"""
+# WeasyPrint lays out in CSS pixels (96 per inch); PDF coordinates are in points (72 per inch).
+PX_TO_PT = 0.75
+STYLESHEET_CACHE_SIZE = 64
+RENDER_TASK_NAME = "handouts.tasks.render_handout_pdf_task"
+
+# Bump whenever a change to section rendering alters the stored HTML fragments.
+SECTION_RENDERER_VERSION = "4"
+MARKDOWN_EXTENSIONS = [
+    "extra",
+    "codehilite",
+    "toc",
+    "attr_list",
+    "tables",
+    "markdown_captions",
+    "pymdownx.blocks.admonition",
+    "handouts.markdown_extensions:MathExtension",
+    "handouts.markdown_extensions:AdmonitionIconExtension",
+    "handouts.markdown_extensions:CodeHighlightExtension",
+]
+# Pygments runs in CodeHighlightExtension, which caches the highlighted blocks.
+MARKDOWN_EXTENSION_CONFIGS = {"codehilite": {"css_class": "highlight", "linenums": False, "use_pygments": False}}
+
+logger = logging.getLogger(__name__)
+
+# Markdown instances are not thread-safe, so each thread keeps its own set.
+_markdown_engines = threading.local()
+
+
+def get_section_render_digest(content):
+    payload = {
+        "renderer": SECTION_RENDERER_VERSION,
+        "math_renderer": MATH_RENDERER_VERSION,
+        "highlight_renderer": HIGHLIGHT_RENDERER_VERSION,
+        "extensions": MARKDOWN_EXTENSIONS,
+        "extension_configs": MARKDOWN_EXTENSION_CONFIGS,
+        "content": content or "",
+    }
+    encoded = json.dumps(payload, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
 
-from .theme import ADMONITION_ICONS, FONT_MAP, THEME_DEFAULTS, get_language_config
 
-logger = logging.getLogger("weasyprint")
-logger.setLevel(logging.DEBUG)
-logger.addHandler(logging.StreamHandler())
+def get_markdown_engine(extensions=MARKDOWN_EXTENSIONS, extension_configs=MARKDOWN_EXTENSION_CONFIGS):
+    key = json.dumps([extensions, extension_configs], sort_keys=True)
+    engines = getattr(_markdown_engines, "engines", None)
+    if engines is None:
+        engines = _markdown_engines.engines = {}
 
+    engine = engines.get(key)
+    if engine is None:
+        engine = engines[key] = markdown.Markdown(extensions=extensions, extension_configs=extension_configs)
+    return engine.reset()
 
-def inject_admonition_icons(html):
-    for alert_type, svg in ADMONITION_ICONS.items():
-        pattern = rf"(<div [^>]*class=[^>]*admonition {alert_type}[^>]*>\s*<p [^>]*class=[^>]*admonition-title[^>]*>)"
-        replacement = rf'\1<span class="admonition-icon">{svg}</span>'
-        html = re.sub(pattern, replacement, html)
-    return html
 
+def render_section_html(content):
+    rendered_html = get_markdown_engine().convert(content or "")
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < settings.PDF_RENDER_LOG_SAMPLE_RATE:
+        logger.debug("Rendered section HTML (%d chars): %.500s", len(rendered_html), rendered_html)
+    return rendered_html
 
-def latex_to_svg_image(text):
-    if not text:
-        return ""
 
-    pattern_block = r"\$\$(.*?)\$\$"
+def get_section_html(section):
+    digest = get_section_render_digest(section.content)
+    if section.render_digest != digest:
+        # Fragment predates the current Markdown pipeline; refresh it once and keep it.
+        section.rendered_html = render_section_html(section.content)
+        section.render_digest = digest
+        if not section._state.adding:
+            type(section).objects.filter(pk=section.pk).update(
+                rendered_html=section.rendered_html, render_digest=digest
+            )
+    return section.rendered_html
 
-    def replace_block(match):
-        encoded_code = urllib.parse.quote(match.group(1).strip())
-        return f'<div class="math-block"><img src="https://latex.codecogs.com/svg.latex?{encoded_code}" /></div>'
 
-    text = re.sub(pattern_block, replace_block, text, flags=re.DOTALL)
+def build_section_tree(sections):
+    children_by_parent = defaultdict(list)
+    for section in sections:
+        children_by_parent[section.parent_id].append(section)
+    for siblings in children_by_parent.values():
+        siblings.sort(key=lambda s: s.order)
+
+    ordered_sections = []
+    stack = list(reversed(children_by_parent[None]))
+    while stack:
+        section = stack.pop()
+        section.tree_children = children_by_parent.get(section.id, [])
+        ordered_sections.append(section)
+        stack.extend(reversed(section.tree_children))
+    return ordered_sections
 
-    pattern_inline = r"\$(.*?)\$"
 
-    def replace_inline(match):
-        encoded_code = urllib.parse.quote(match.group(1).strip())
-        return f'<img class="math-inline" src="https://latex.codecogs.com/svg.latex?{encoded_code}" />'
+def load_section_tree(handout):
+    return build_section_tree(handout.sections.all())
 
-    return re.sub(pattern_inline, replace_inline, text)
 
+def select_sections(sections, section_id, subtree=False):
+    root = next((section for section in sections if str(section.id) == str(section_id)), None)
+    if root is None:
+        return []
+    if not subtree:
+        return [root]
 
-def get_recursive_sections(handout, parent=None):
-    ordered_sections = []
-    sections = handout.sections.filter(parent=parent).order_by("order")
-    for section in sections:
-        ordered_sections.append(section)
-        ordered_sections.extend(get_recursive_sections(handout, parent=section))
-    return ordered_sections
+    selected = []
+    stack = [root]
+    while stack:
+        section = stack.pop()
+        selected.append(section)
+        stack.extend(reversed(section.tree_children))
+    return selected
 
 
-def generate_handout_pdf(handout):
+def load_handout_config(handout):
     user_config = handout.yaml_config
     if isinstance(user_config, str):
         try:
@@ -67,7 +167,110 @@ def generate_handout_pdf(handout):
             user_config = {}
     elif not isinstance(user_config, dict):
         user_config = {}
+    return user_config
+
+
+@functools.lru_cache(maxsize=32)
+def _digest_file(path, mtime_ns, size):
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def digest_file(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return ""
+    return _digest_file(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+def get_stylesheet_path():
+    return os.path.join(settings.BASE_DIR / "static", "css/pdf/handout_style.css")
+
+
+def get_template_path():
+    return os.path.join(settings.BASE_DIR / "templates", PDF_TEMPLATE_NAME)
+
+
+def get_stylesheet_template_path():
+    return os.path.join(settings.BASE_DIR / "templates", PDF_STYLESHEET_TEMPLATE_NAME)
+
+
+def get_chunk_stylesheet_template_path():
+    return os.path.join(settings.BASE_DIR / "templates", PDF_CHUNK_STYLESHEET_TEMPLATE_NAME)
+
+
+@functools.lru_cache(maxsize=1)
+def get_font_config():
+    # Shared so @font-face rules from cached stylesheets stay valid for every render.
+    return FontConfiguration()
 
+
+@functools.lru_cache(maxsize=STYLESHEET_CACHE_SIZE)
+def _render_stylesheet(variant, stylesheet_digest, template_digest):
+    try:
+        with open(get_stylesheet_path(), "r", encoding="utf-8") as f:
+            custom_css = f.read()
+    except Exception as e:
+        logger.warning(f"Failed to load CSS file: {e}")
+        custom_css = ""
+
+    return render_to_string(PDF_STYLESHEET_TEMPLATE_NAME, {**json.loads(variant), "custom_css": custom_css})
+
+
+@functools.lru_cache(maxsize=STYLESHEET_CACHE_SIZE)
+def _compile_stylesheet(variant, stylesheet_digest, template_digest):
+    css_string = _render_stylesheet(variant, stylesheet_digest, template_digest)
+    return CSS(string=css_string, base_url=str(settings.BASE_DIR), font_config=get_font_config())
+
+
+def _get_stylesheet_key(stylesheet_context):
+    variant = json.dumps(stylesheet_context, sort_keys=True, default=str)
+    return variant, digest_file(get_stylesheet_path()), digest_file(get_stylesheet_template_path())
+
+
+def get_stylesheet_css(stylesheet_context):
+    return _render_stylesheet(*_get_stylesheet_key(stylesheet_context))
+
+
+def get_compiled_stylesheet(stylesheet_context):
+    return _compile_stylesheet(*_get_stylesheet_key(stylesheet_context))
+
+
+def compute_handout_digest(handout, sections, user_config, show_front_matter=True):
+    payload = {
+        "renderer": RENDERER_VERSION,
+        "weasyprint": weasyprint.__version__,
+        "title": handout.title,
+        "subtitle": handout.subtitle,
+        "description": handout.description,
+        "config": user_config,
+        # The cover falls back to today's date, so undated handouts go stale daily.
+        "date": user_config.get("date", datetime.now().strftime("%B %d, %Y")),
+        # The fragment digest covers the Markdown pipeline as well as the content.
+        "sections": [
+            [
+                str(s.id),
+                str(s.parent_id) if s.parent_id else None,
+                s.order,
+                s.level,
+                s.title,
+                get_section_render_digest(s.content),
+            ]
+            for s in sections
+        ],
+        "stylesheet": digest_file(get_stylesheet_path()),
+        "template": digest_file(get_template_path()),
+        "stylesheet_template": digest_file(get_stylesheet_template_path()),
+        "chunk_stylesheet_template": digest_file(get_chunk_stylesheet_template_path()),
+        "front_matter": show_front_matter,
+        "images": [IMAGE_VARIANT_VERSION, settings.PDF_IMAGE_DPI, settings.PDF_IMAGE_JPEG_QUALITY],
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def build_render_context(handout, sections, user_config, static_url=None, anchor_start=1, show_front_matter=True):
     lang_cfg = get_language_config(user_config.get("language", "en"))
     display_subtitle = handout.subtitle.replace("|", "<br />") if handout.subtitle else ""
     selected_theme = user_config.get("theme", "nordic_dark")
@@ -103,63 +306,452 @@ def generate_handout_pdf(handout):
         "toc_title": lang_cfg["toc_title"],
     }
 
-    sections_data = []
-    md_extensions = [
-        "extra",
-        "codehilite",
-        "toc",
-        "attr_list",
-        "tables",
-        "markdown_captions",
-        "pymdownx.blocks.admonition",
+    sections_data = [
+        {
+            "title": section.title,
+            "html_body": get_section_html(section),
+            "level": section.level,
+            "anchor": f"section-{index}",
+        }
+        for index, section in enumerate(sections, start=anchor_start)
+    ]
+
+    stylesheet_context = {
+        "config": {
+            "base_font": config["base_font"],
+            "indent_mode": config["indent_mode"],
+            "page_number_content": config["page_number_content"],
+            "page_number_pos": config["page_number_pos"],
+        },
+        "typography": typography,
+        "static_url": static_url or (settings.BASE_DIR / "static").as_uri(),
+        "fig_label": lang_cfg["fig_label"],
+        # The cover's blank first page is only styled when the cover is rendered.
+        "show_front_matter": show_front_matter,
+    }
+
+    context = {
+        "title": handout.title,
+        "subtitle": display_subtitle,
+        "description": handout.description,
+        "sections": sections_data,
+        "config": config,
+        "show_front_matter": show_front_matter,
+        "show_sections": True,
+    }
+    return context, stylesheet_context
+
+
+def render_handout_pdf(handout, sections, user_config, show_front_matter=True, target=None):
+    """Return the PDF as bytes, or write it to target (a path or file object) and return None."""
+    if should_render_in_chunks(sections):
+        return render_handout_pdf_chunked(handout, sections, user_config, show_front_matter, target)
+    with metrics.span("template"):
+        context, stylesheet_context = build_render_context(
+            handout, sections, user_config, show_front_matter=show_front_matter
+        )
+        html_string = render_to_string(PDF_TEMPLATE_NAME, context)
+    with metrics.span("stylesheet"):
+        stylesheet = get_compiled_stylesheet(stylesheet_context)
+    with metrics.span("layout"):
+        html = HTML(string=html_string, base_url=str(settings.BASE_DIR), url_fetcher=CachingURLFetcher())
+        document = html.render(stylesheets=[stylesheet], font_config=get_font_config())
+    with metrics.span("write_pdf"):
+        return document.write_pdf(target)
+
+
+def split_section_chunks(sections):
+    """Split the ordered section list into top-level sections, each with its descendants."""
+    chunks = []
+    for section in sections:
+        if section.parent_id is None or not chunks:
+            chunks.append([])
+        chunks[-1].append(section)
+    return chunks
+
+
+def should_render_in_chunks(sections):
+    threshold = settings.PDF_CHUNKED_RENDER_MIN_HTML_SIZE
+    if not threshold or sum(len(get_section_html(section)) for section in sections) < threshold:
+        return False
+    return len(split_section_chunks(sections)) > 1
+
+
+def render_handout_chunk(handout, sections, user_config, anchor_start, front_matter):
+    with metrics.span("template"):
+        context, stylesheet_context = build_render_context(
+            handout, sections, user_config, anchor_start=anchor_start, show_front_matter=front_matter
+        )
+        # The front matter chunk only needs the sections for its table of contents.
+        context["show_sections"] = not front_matter
+        html_string = render_to_string(PDF_TEMPLATE_NAME, context)
+    with metrics.span("stylesheet"):
+        chunk_css = render_to_string(
+            PDF_CHUNK_STYLESHEET_TEMPLATE_NAME, {"page_number_pos": stylesheet_context["config"]["page_number_pos"]}
+        )
+        stylesheets = [
+            get_compiled_stylesheet(stylesheet_context),
+            CSS(string=chunk_css, font_config=get_font_config()),
+        ]
+    with metrics.span("layout"):
+        html = HTML(string=html_string, base_url=str(settings.BASE_DIR), url_fetcher=CachingURLFetcher())
+        return html.render(stylesheets=stylesheets, font_config=get_font_config())
+
+
+def render_page_numbers(handout, user_config, show_front_matter, page_count, target):
+    """Write a PDF of page_count blank pages that carry only the handout's page numbers."""
+    # Margin boxes do not depend on the page content, so laying out empty pages numbers the whole
+    # stitched document at a fraction of the cost of a second pass over the chunks.
+    _, stylesheet_context = build_render_context(handout, [], user_config, show_front_matter=show_front_matter)
+    html_string = "<html><body>" + '<div class="page-number-sheet"></div>' * page_count + "</body></html>"
+    stylesheets = [
+        get_compiled_stylesheet(stylesheet_context),
+        CSS(string=PAGE_NUMBER_SHEET_CSS, font_config=get_font_config()),
     ]
-    md_configs = {"codehilite": {"css_class": "highlight", "linenums": False, "guess_lang": True}}
+    document = HTML(string=html_string, base_url=str(settings.BASE_DIR)).render(
+        stylesheets=stylesheets, font_config=get_font_config()
+    )
+    document.write_pdf(target)
+
+
+def render_handout_pdf_chunked(handout, sections, user_config, show_front_matter=True, target=None):
+    """Lay out each top-level section on its own and stitch the PDFs, so only one chunk's boxes are alive at once.
+
+    Every chunk starts on a new page. Chunks are laid out without page numbers; once the page total is
+    known they are stamped from a document of blank numbered pages. Bookmarks and links between chunks
+    are rebuilt on the stitched file from the anchors each chunk reports.
+    """
+    chunks, anchor_start = [], 1
+    if show_front_matter:
+        chunks.append((sections, anchor_start, True))
+    for chunk in split_section_chunks(sections):
+        chunks.append((chunk, anchor_start, False))
+        anchor_start += len(chunk)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths, bookmarks, anchors, links = [], [], {}, []
+        page_offset = 0
+        for index, (chunk, anchor_start, front_matter) in enumerate(chunks):
+            document = render_handout_chunk(handout, chunk, user_config, anchor_start, front_matter)
+            local_anchors = {name for page in document.pages for name in page.anchors}
+            for page_number, page in enumerate(document.pages, start=page_offset):
+                height = page.height * PX_TO_PT
+                for name, (x, y, *_) in page.anchors.items():
+                    anchors.setdefault(name, (page_number, x * PX_TO_PT, height - y * PX_TO_PT))
+                # WeasyPrint drops links to anchors in other chunks; they are added back after stitching.
+                page_links = []
+                for link in page.links:
+                    link_type, name, (x1, y1, x2, y2), _ = link
+                    if link_type == "internal" and name not in local_anchors:
+                        rect = (x1 * PX_TO_PT, height - y2 * PX_TO_PT, x2 * PX_TO_PT, height - y1 * PX_TO_PT)
+                        links.append((page_number, rect, name))
+                    else:
+                        page_links.append(link)
+                page.links = page_links
+            bookmarks.extend(offset_bookmarks(document.make_bookmark_tree(PX_TO_PT, transform_pages=True), page_offset))
+
+            with metrics.span("write_pdf"):
+                path = os.path.join(tmp_dir, f"{index}.pdf")
+                document.write_pdf(path)
+            paths.append(path)
+            page_offset += len(document.pages)
+            del document
+
+        with metrics.span("page_numbers"):
+            page_numbers_path = os.path.join(tmp_dir, "page-numbers.pdf")
+            render_page_numbers(handout, user_config, show_front_matter, page_offset, page_numbers_path)
+        with metrics.span("stitch"):
+            resolved = [(page, rect, anchors[name]) for page, rect, name in links if name in anchors]
+            return stitch_pdfs(paths, bookmarks, resolved, target, overlay=page_numbers_path)
+
+
+def get_render_limits(handout):
+    return handout.project.owner.render_limits
+
+
+def render_handout_pdf_sandboxed(
+    handout, sections, user_config, show_front_matter=True, limits=None, cancel_check=None, target=None
+):
+    if not settings.PDF_RENDER_SANDBOX_ENABLED:
+        return render_handout_pdf(handout, sections, user_config, show_front_matter, target)
+    limits = get_render_limits(handout) if limits is None else limits
+    return run_sandboxed(
+        render_handout_pdf,
+        handout,
+        sections,
+        user_config,
+        show_front_matter,
+        target,
+        cancel_check=cancel_check,
+        **limits,
+    )
+
+
+def render_handout_preview(handout, sections, user_config, show_front_matter=True):
+    # Browsers cannot load file:// fonts, so the preview points them at the static files route.
+    static_url = "/" + settings.STATIC_URL.strip("/")
+    context, stylesheet_context = build_render_context(
+        handout, sections, user_config, static_url=static_url, show_front_matter=show_front_matter
+    )
+    context["inline_css"] = get_stylesheet_css(stylesheet_context)
+    return render_to_string(PDF_TEMPLATE_NAME, context)
+
+
+def prepare_handout_render(handout, section_id=None, subtree=False):
+    with metrics.span("config"):
+        user_config = load_handout_config(handout)
+    with metrics.span("sections"):
+        sections = load_section_tree(handout)
+        if section_id:
+            sections = select_sections(sections, section_id, subtree)
+    with metrics.span("markdown"):
+        for section in sections:
+            # Refresh stale fragments up front so the render itself needs no database access.
+            get_section_html(section)
+    with metrics.span("digest"):
+        digest = compute_handout_digest(handout, sections, user_config, show_front_matter=not section_id)
+    return digest, sections, user_config
+
+
+def render_handout_pdf_once(
+    digest, handout, sections, user_config, show_front_matter=True, limits=None, cancel_check=None
+):
+    # The renderer writes straight into the cache file, so the PDF never crosses back as bytes.
+    write = functools.partial(
+        render_handout_pdf_sandboxed, handout, sections, user_config, show_front_matter, limits, cancel_check
+    )
+    return pdf_cache.get_or_create_path(
+        digest,
+        write,
+        lock_timeout=settings.PDF_RENDER_LOCK_TIMEOUT,
+        failure_ttl=settings.PDF_RENDER_FAILURE_TTL,
+        transient_errors=(RenderCancelled,),
+    )
+
+
+def get_handout_last_modified(handout, sections, user_config):
+    """Return when the export last changed, from timestamps every process sees alike.
+
+    Stylesheet, template and renderer changes leave the rows untouched, so the modification times of
+    those files count too, as does the start of today for undated handouts, whose cover shows the date.
+    """
+    paths = [
+        get_stylesheet_path(),
+        get_template_path(),
+        get_stylesheet_template_path(),
+        get_chunk_stylesheet_template_path(),
+        __file__,
+    ]
+    times = [handout.updated_at, *(section.updated_at for section in sections)]
+    times.extend(datetime.fromtimestamp(os.path.getmtime(path), tz=UTC) for path in paths if os.path.exists(path))
+    if "date" not in user_config:
+        times.append(timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0))
+    return max(times)
+
+
+def render_handout_to_cache(
+    handout, section_id=None, subtree=False, cancel_check=None, single_flight=True, prepared=None
+):
+    digest, sections, user_config = prepared or prepare_handout_render(handout, section_id, subtree)
+
+    with metrics.span("cache"):
+        path = pdf_cache.get_path(digest)
+    if path is None and single_flight:
+        path = render_handout_pdf_once(
+            digest, handout, sections, user_config, show_front_matter=not section_id, cancel_check=cancel_check
+        )
+    elif path is None:
+        write = functools.partial(
+            render_handout_pdf_sandboxed, handout, sections, user_config, not section_id, None, cancel_check
+        )
+        path = pdf_cache.create(digest, write)
+    return digest, path
+
+
+def dispatch_handout_render(handout, digest, sections, user_config, target):
+    result = current_app.send_task(RENDER_TASK_NAME, args=[str(handout.id), digest], queue=settings.PDF_RENDER_QUEUE)
+    with metrics.span("pool"):
+        rendered_digest = result.get(timeout=settings.PDF_RENDER_POOL_TIMEOUT)
+    rendered_path = pdf_cache.path_for(rendered_digest)
+    if rendered_digest == digest and rendered_path.exists():
+        shutil.copyfile(rendered_path, target)
+    else:
+        # The handout changed before the worker loaded it, or the worker does not share this cache
+        # directory; render the version this digest stands for here.
+        render_handout_pdf_sandboxed(handout, sections, user_config, target=target)
+
+
+def render_handout_in_pool(handout, prepared=None):
+    digest, sections, user_config = prepared or prepare_handout_render(handout)
+    path = pdf_cache.get_path(digest)
+    if path is None:
+        # Only the lock holder sends a task; concurrent requests wait for its result.
+        path = pdf_cache.get_or_create_path(
+            digest,
+            functools.partial(dispatch_handout_render, handout, digest, sections, user_config),
+            lock_timeout=settings.PDF_RENDER_LOCK_TIMEOUT,
+            failure_ttl=settings.PDF_RENDER_FAILURE_TTL,
+        )
+    return digest, path
+
+
+def record_handout_download(handout, file_size):
+    # Buffered for the flush_download_events task when a Redis buffer is configured, else written now.
+    analytics.record_download(handout.id, file_size)
+
+
+def get_handout_pdf(handout, cancel_check=None, prepared=None):
+    if settings.PDF_RENDER_POOL_ENABLED:
+        return render_handout_in_pool(handout, prepared)
+    return render_handout_to_cache(handout, cancel_check=cancel_check, prepared=prepared)
+
+
+def generate_handout_pdf(
+    handout, section_id=None, subtree=False, cancel_check=None, prepared=None, record_download=True
+):
+    """Return the cached PDF's path; prepared is the result of prepare_handout_render, if already at hand."""
+    if section_id:
+        # Section previews are small, so they render in process and do not count as downloads.
+        _, path = render_handout_to_cache(handout, section_id, subtree, cancel_check, prepared=prepared)
+        return path
 
-    all_ordered_sections = get_recursive_sections(handout)
-    for section in all_ordered_sections:
-        content_with_latex = latex_to_svg_image(section.content or "")
-        rendered_html = markdown.markdown(content_with_latex, extensions=md_extensions, extension_configs=md_configs)
+    _, path = get_handout_pdf(handout, cancel_check, prepared)
+    if record_download:
+        record_handout_download(handout, path.stat().st_size)
+    return path
 
-        logger.debug(f"DEBUG HTML for {section.title}: {rendered_html}")
 
-        rendered_html = inject_admonition_icons(rendered_html)
+def get_handout_digest(handout):
+    return compute_handout_digest(handout, load_section_tree(handout), load_handout_config(handout))
 
-        if "http://localhost:8000/media/" in rendered_html:
-            rendered_html = rendered_html.replace("http://localhost:8000/media/", f"file://{settings.MEDIA_ROOT}/")
-        # elif rendered_html.find('src="' + settings.MEDIA_URL) != -1:
-        #     rendered_html = rendered_html.replace('src="' + settings.MEDIA_URL, f'src="file://{settings.MEDIA_ROOT}/')
 
-        sections_data.append({"title": section.title, "html_body": rendered_html, "level": section.level})
+def generate_handout_thumbnail(handout, page=0):
+    digest = get_handout_digest(handout)
+    path = thumbnail_cache.get_path(get_thumbnail_key(digest, page))
+    if path is not None:
+        return digest, path
 
-    actual_static_path = settings.BASE_DIR / "static"
-    css_file_path = os.path.join(actual_static_path, "css/pdf/handout_style.css")
+    # Rasterize every thumbnail page from one render so later pages are cache hits.
+    digest, pdf_path = get_handout_pdf(handout)
+    thumbnails = render_pdf_thumbnails(pdf_path, settings.PDF_THUMBNAIL_PAGES, settings.PDF_THUMBNAIL_WIDTH)
+    for index, png in enumerate(thumbnails):
+        stored_path = thumbnail_cache.set(get_thumbnail_key(digest, index), png)
+        if index == page:
+            path = stored_path
+    return digest, path
 
+
+def get_zip_entry_name(handout):
+    safe_title = "".join([c for c in handout.title if c.isalnum() or c in (" ", "-", "_")]).strip()
+    return f"{safe_title}.pdf"
+
+
+def iter_handout_pdfs(handouts, workers=None, cancel_check=None):
+    """Yield (handout, path or None) as each PDF becomes available, cached ones first."""
+    workers = settings.PDF_ZIP_WORKERS if workers is None else workers
+    cached = []
+    pending = []
+    limits_by_project = {}
+    for handout in handouts:
+        try:
+            digest, sections, user_config = prepare_handout_render(handout)
+            if handout.project_id not in limits_by_project:
+                limits_by_project[handout.project_id] = get_render_limits(handout)
+        except Exception as e:
+            logger.error(f"Failed to prepare {handout.title}: {str(e)}")
+            cached.append((handout, None))
+            continue
+        path = pdf_cache.get_path(digest)
+        if path is not None:
+            cached.append((handout, path))
+        else:
+            pending.append((handout, digest, sections, user_config, limits_by_project[handout.project_id]))
+
+    # Celery prefork children are daemonic and may not start processes of their own.
+    if workers <= 1 or len(pending) <= 1 or multiprocessing.current_process().daemon:
+        yield from cached
+        for handout, digest, sections, user_config, limits in pending:
+            try:
+                path = render_handout_pdf_once(
+                    digest, handout, sections, user_config, limits=limits, cancel_check=cancel_check
+                )
+            except RenderCancelled:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to render {handout.title}: {str(e)}")
+                yield handout, None
+                continue
+            yield handout, path
+        return
+
+    executor = ProcessPoolExecutor(max_workers=min(workers, len(pending)), initializer=django.setup)
     try:
-        with open(css_file_path, "r", encoding="utf-8") as f:
-            custom_css = f.read()
+        futures = {}
+        for handout, digest, sections, user_config, limits in pending:
+            future = executor.submit(render_handout_pdf_once, digest, handout, sections, user_config, limits=limits)
+            futures[future] = handout, digest
+        yield from cached
+        for future in as_completed(futures):
+            if cancel_check and cancel_check():
+                raise RenderCancelled("Render was cancelled.")
+            handout, digest = futures[future]
+            try:
+                path = future.result()
+            except Exception as e:
+                logger.error(f"Failed to render {handout.title}: {str(e)}")
+                yield handout, None
+                continue
+            yield handout, path
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def add_zip_entry(zip_file, handout, path):
+    if path is None:
+        return
+    try:
+        zip_file.write(path, get_zip_entry_name(handout))
+        record_handout_download(handout, path.stat().st_size)
     except Exception as e:
-        logger.warning(f"Failed to load CSS file: {e}")
-        custom_css = ""
+        logger.error(f"Failed to add {handout.title} to zip: {str(e)}")
 
-    context = {
-        "title": handout.title,
-        "subtitle": display_subtitle,
-        "description": handout.description,
-        "sections": sections_data,
-        "config": config,
-        "typography": typography,
-        "static_root": actual_static_path,
-        "custom_css": custom_css,
-        "fig_label": lang_cfg["fig_label"],
-    }
 
-    html_string = render_to_string("pdf/handout_template.html", context)
-    pdf_content = HTML(string=html_string, base_url=str(settings.BASE_DIR)).write_pdf()
+def write_handouts_zip(handouts, fileobj, on_progress=None, workers=None, cancel_check=None):
+    handouts = list(handouts)
+    # PDFs are already compressed; deflating them again only costs CPU.
+    with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_STORED) as zip_file:
+        for index, (handout, path) in enumerate(iter_handout_pdfs(handouts, workers, cancel_check), start=1):
+            add_zip_entry(zip_file, handout, path)
+            if on_progress:
+                on_progress(index, len(handouts))
+
+
+class ZipStream:
+    """Write-only sink that hands finished ZIP bytes over to a streaming response."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
 
-    handout.file_size = len(pdf_content)
-    handout.last_downloaded_at = timezone.now()
-    handout.save(update_fields=["file_size", "last_downloaded_at"])
-    return pdf_content
+def stream_handouts_zip(handouts, workers=None):
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED) as zip_file:
+        for handout, path in iter_handout_pdfs(handouts, workers):
+            add_zip_entry(zip_file, handout, path)
+            yield stream.drain()
+    yield stream.drain()
 
 
 def trigger_storage_email(user, usage, limit, level):
@@ -1,16 +1,97 @@
+import re
+
+from django.conf import settings
+from django.core import signing
 from django.db import transaction
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
-from drf_spectacular.utils import extend_schema, extend_schema_view
+from drf_spectacular.utils import OpenApiParameter, extend_schema, extend_schema_view
 from rest_framework import exceptions, permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.filters import OrderingFilter, SearchFilter
+from rest_framework.generics import get_object_or_404
 from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import metrics
+from .cache import LockWaitTimeout, pdf_cache
+from .enums import ExportJobKind, ExportJobStatus
+from .models import Attachment, ExportJob, Handout, Section
+from .sandbox import RenderLimitExceeded
+from .serializers import AttachmentSerializer, ExportJobSerializer, HandoutSerializer, SectionSerializer
+from .tasks import cancel_export_job, enqueue_export_job
+from .utils import (
+    generate_handout_pdf,
+    generate_handout_thumbnail,
+    get_handout_last_modified,
+    get_zip_entry_name,
+    prepare_handout_render,
+    record_handout_download,
+    render_handout_preview,
+)
+
+BYTE_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+PDF_DOWNLOAD_SALT = "handouts.pdf-download"
+
+
+def parse_byte_range(header, size):
+    """Return an inclusive (start, end) for a single byte range, or None to send the whole body.
 
-from .models import Attachment, Handout, Section
-from .serializers import AttachmentSerializer, HandoutSerializer, SectionSerializer
-from .utils import generate_handout_pdf
+    Raises ValueError when the range cannot be satisfied.
+    """
+    match = BYTE_RANGE_RE.fullmatch(header.strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        if not int(last):
+            raise ValueError("Empty suffix range")
+        start, end = max(size - int(last), 0), size - 1
+    if start >= size:
+        raise ValueError("Range starts past the end")
+    return start, end
+
+
+def pdf_file_response(request, path, etag, last_modified=None):
+    """Stream a cached PDF from disk, or the single byte range the request asks for."""
+    size = path.stat().st_size
+    byte_range = None
+    if_range = request.headers.get("If-Range")
+    if "Range" in request.headers and if_range in (None, etag, last_modified and http_date(last_modified)):
+        try:
+            byte_range = parse_byte_range(request.headers["Range"], size)
+        except ValueError:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    if byte_range is None:
+        # Served through wsgi.file_wrapper, so the server can sendfile() it.
+        response = FileResponse(open(path, "rb"), content_type="application/pdf")
+    else:
+        start, end = byte_range
+        with open(path, "rb") as f:
+            f.seek(start)
+            chunk = f.read(end - start + 1)
+        response = HttpResponse(chunk, content_type="application/pdf", status=status.HTTP_206_PARTIAL_CONTENT)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    response["ETag"] = etag
+    if last_modified:
+        response["Last-Modified"] = http_date(last_modified)
+    response["Accept-Ranges"] = "bytes"
+    return response
 
 
 @extend_schema_view(
@@ -32,7 +113,7 @@ class HandoutViewSet(viewsets.ModelViewSet):
     ordering = ["-updated_at"]
 
     def get_queryset(self):
-        return Handout.objects.filter(project__owner=self.request.user)
+        return Handout.objects.filter(project__owner=self.request.user).prefetch_related("sections")
 
     def perform_create(self, serializer):
         project = serializer.validated_data.get("project")
@@ -105,17 +186,135 @@ class HandoutViewSet(viewsets.ModelViewSet):
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
     @extend_schema(
-        responses={(200, "application/pdf"): {"type": "string", "format": "binary"}},
+        parameters=[
+            OpenApiParameter("async", bool, description="Render in the background and return a job"),
+            OpenApiParameter("section", str, description="Render a single section by id, without cover or TOC"),
+            OpenApiParameter("subtree", bool, description="Include the descendants of the chosen section"),
+        ],
+        responses={
+            (200, "application/pdf"): {"type": "string", "format": "binary"},
+            (206, "application/pdf"): {"type": "string", "format": "binary"},
+            202: ExportJobSerializer,
+            304: None,
+            422: {"type": "object", "properties": {"error": {"type": "string"}, "limit": {"type": "string"}}},
+        },
         tags=["Content - Handouts"],
     )
     @action(detail=True, methods=["get"], url_path="export-pdf")
     def export_pdf(self, request, pk=None):
         handout = self.get_object()
+        section_id = request.query_params.get("section")
+        if section_id:
+            get_object_or_404(handout.sections, pk=section_id)
+        subtree = request.query_params.get("subtree", "").lower() in ("1", "true")
+
+        if not section_id and request.query_params.get("async", "").lower() in ("1", "true"):
+            job = enqueue_export_job(
+                owner=request.user,
+                handout=handout,
+                kind=ExportJobKind.PDF,
+                artifact_name=get_zip_entry_name(handout),
+            )
+            serializer = ExportJobSerializer(job, context={"request": request})
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
         try:
-            pdf_content = generate_handout_pdf(handout)
-            return HttpResponse(pdf_content, content_type="application/pdf")
+            with metrics.collect_spans() as spans:
+                prepared = prepare_handout_render(handout, section_id, subtree)
+                etag = quote_etag(prepared[0])
+                last_modified = get_handout_last_modified(handout, prepared[1], prepared[2])
+                last_modified = int(last_modified.timestamp())
+                # Unchanged handouts are answered before any rendering or download bookkeeping.
+                response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+                if response is not None:
+                    response["ETag"] = etag
+                    response["Last-Modified"] = http_date(last_modified)
+                    return response
+                pdf_path = generate_handout_pdf(handout, section_id, subtree, prepared=prepared, record_download=False)
+
+            if settings.PDF_DOWNLOAD_MODE == "redirect":
+                if not section_id:
+                    record_handout_download(handout, pdf_path.stat().st_size)
+                token = signing.dumps(prepared[0], salt=PDF_DOWNLOAD_SALT)
+                return HttpResponseRedirect(reverse("handout-pdf-download", kwargs={"token": token}))
+
+            response = pdf_file_response(request, pdf_path, etag, last_modified)
+            # Viewers fetching later chunks of a document already counted do not count again.
+            if not section_id and response.get("Content-Range", "bytes 0-").startswith("bytes 0-"):
+                record_handout_download(handout, pdf_path.stat().st_size)
+            response["Server-Timing"] = metrics.format_server_timing(spans)
+            return response
         except PermissionError as e:
             return Response({"error": str(e)}, status=status.HTTP_403_FORBIDDEN)
+        except RenderLimitExceeded as e:
+            return Response({"error": str(e), "limit": e.limit}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        except LockWaitTimeout:
+            return Response({"error": "The PDF is still being rendered."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter("section", str, description="Preview a single section by id"),
+            OpenApiParameter("subtree", bool, description="Include the descendants of the chosen section"),
+        ],
+        responses={(200, "text/html"): {"type": "string"}, 304: None},
+        tags=["Content - Handouts"],
+    )
+    @action(detail=True, methods=["get"], url_path="preview-html")
+    def preview_html(self, request, pk=None):
+        handout = self.get_object()
+        section_id = request.query_params.get("section")
+        if section_id:
+            get_object_or_404(handout.sections, pk=section_id)
+        subtree = request.query_params.get("subtree", "").lower() in ("1", "true")
+        digest, sections, user_config = prepare_handout_render(handout, section_id, subtree)
+
+        etag = quote_etag(digest)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            html = render_handout_preview(handout, sections, user_config, show_front_matter=not section_id)
+            response = HttpResponse(html, content_type="text/html; charset=utf-8")
+            # Sections may carry raw HTML, so the preview runs in an opaque origin without scripts.
+            response["Content-Security-Policy"] = "sandbox"
+            response["X-Content-Type-Options"] = "nosniff"
+        response["ETag"] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter("page", int, description="Zero-based page index; 0 is the cover"),
+            OpenApiParameter("v", str, description="Render digest from the handout payload"),
+        ],
+        responses={(200, "image/png"): {"type": "string", "format": "binary"}},
+        tags=["Content - Handouts"],
+    )
+    @action(detail=True, methods=["get"], url_path="thumbnail")
+    def thumbnail(self, request, pk=None):
+        handout = self.get_object()
+        try:
+            page = int(request.query_params.get("page", 0))
+        except ValueError:
+            page = -1
+        if not 0 <= page < settings.PDF_THUMBNAIL_PAGES:
+            return Response({"error": "Invalid page."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            digest, path = generate_handout_thumbnail(handout, page)
+        except RenderLimitExceeded as e:
+            return Response({"error": str(e), "limit": e.limit}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        except LockWaitTimeout:
+            return Response({"error": "The PDF is still being rendered."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        if path is None:
+            return Response({"error": "Page not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        response = FileResponse(open(path, "rb"), content_type="image/png")
+        response["ETag"] = quote_etag(f"{digest}-{page}")
+        if request.query_params.get("v") == digest[:16]:
+            # Versioned URLs change whenever the handout does, so they can be cached indefinitely.
+            patch_cache_control(response, private=True, max_age=settings.PDF_THUMBNAIL_MAX_AGE, immutable=True)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
 
 
 @extend_schema_view(
@@ -139,6 +338,11 @@ class SectionViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Section.objects.filter(handout__project__owner=self.request.user)
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["flat"] = self.request.query_params.get("flat", "").lower() in ("1", "true")
+        return context
+
     def perform_create(self, serializer):
         handout = serializer.validated_data.get("handout")
         if handout.project.owner != self.request.user:
@@ -174,3 +378,73 @@ class AttachmentViewSet(viewsets.ModelViewSet):
             file_size=file_obj.size,
             mime_type=file_obj.content_type,
         )
+
+
+@extend_schema_view(
+    list=extend_schema(tags=["Content - Export Jobs"]),
+    retrieve=extend_schema(tags=["Content - Export Jobs"]),
+)
+class ExportJobViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = ExportJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_fields = ["kind", "status", "handout", "project"]
+    ordering = ["-created_at"]
+
+    def get_queryset(self):
+        return ExportJob.objects.filter(owner=self.request.user)
+
+    @extend_schema(
+        responses={(200, "application/octet-stream"): {"type": "string", "format": "binary"}},
+        tags=["Content - Export Jobs"],
+    )
+    @action(detail=True, methods=["get"], url_path="download")
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != ExportJobStatus.SUCCESS:
+            return Response({"error": f"Export is {job.status}."}, status=status.HTTP_409_CONFLICT)
+
+        try:
+            artifact = open(settings.EXPORT_ARTIFACT_DIR / job.artifact_path, "rb")
+        except FileNotFoundError:
+            return Response({"error": "Export artifact has expired."}, status=status.HTTP_410_GONE)
+
+        content_type = "application/zip" if job.kind == ExportJobKind.ZIP else "application/pdf"
+        return FileResponse(artifact, as_attachment=True, filename=job.artifact_name, content_type=content_type)
+
+    @extend_schema(request=None, responses={200: ExportJobSerializer}, tags=["Content - Export Jobs"])
+    @action(detail=True, methods=["post"], url_path="cancel")
+    def cancel(self, request, pk=None):
+        job = self.get_object()
+        if job.status not in (ExportJobStatus.PENDING, ExportJobStatus.RUNNING):
+            return Response({"error": f"Export is {job.status}."}, status=status.HTTP_409_CONFLICT)
+
+        cancel_export_job(job)
+        return Response(self.get_serializer(job).data)
+
+
+class SignedPDFDownloadView(APIView):
+    """Serves a cached PDF to anyone holding a short-lived link issued by export-pdf."""
+
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+
+    @extend_schema(
+        responses={(200, "application/pdf"): {"type": "string", "format": "binary"}},
+        tags=["Content - Handouts"],
+    )
+    def get(self, request, token):
+        try:
+            digest = signing.loads(token, salt=PDF_DOWNLOAD_SALT, max_age=settings.PDF_SIGNED_URL_MAX_AGE)
+        except signing.SignatureExpired:
+            return Response({"error": "Download link has expired."}, status=status.HTTP_410_GONE)
+        except signing.BadSignature:
+            return Response({"error": "Invalid download link."}, status=status.HTTP_404_NOT_FOUND)
+
+        path = pdf_cache.get_path(digest)
+        if path is None:
+            return Response({"error": "Download link has expired."}, status=status.HTTP_410_GONE)
+        response = pdf_file_response(request, path, quote_etag(digest))
+        patch_cache_control(response, private=True, max_age=settings.PDF_SIGNED_URL_MAX_AGE)
+        return response
@@ -1,6 +1,12 @@
+import io
+import zipfile
+
 import pytest
 from accounts.models import User
+from django.core.cache import cache
 from django.urls import reverse
+from handouts.cache import pdf_cache
+from handouts.models import Handout, Section
 from projects.models import Project
 from rest_framework import status
 from rest_framework.test import APIClient
@@ -37,3 +43,26 @@ class TestProjects:
         response = api_client.get(url)
         assert response.status_code == status.HTTP_200_OK
         assert len(response.data["results"]) == 0
+
+    def test_download_zip_streams_stored_entries(self, api_client, test_user, settings, tmp_path):
+        settings.PDF_CACHE_DIR = tmp_path / "pdf"
+        settings.MATH_CACHE_DIR = tmp_path / "math"
+        cache.clear()
+        project = Project.objects.create(name="Course", owner=test_user)
+        for title in ("Week 1", "Week 2", "Week 3"):
+            handout = Handout.objects.create(project=project, title=title)
+            Section.objects.create(handout=handout, title="Intro", content=f"# {title}")
+
+        api_client.force_authenticate(user=test_user)
+        url = reverse("project-download-all-handouts", kwargs={"pk": project.id})
+        first = api_client.get(url)
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(first.streaming_content)))
+
+        assert first.status_code == status.HTTP_200_OK
+        assert sorted(archive.namelist()) == ["Week 1.pdf", "Week 2.pdf", "Week 3.pdf"]
+        assert {info.compress_type for info in archive.infolist()} == {zipfile.ZIP_STORED}
+        assert pdf_cache.stats()["misses"] == 3
+
+        second = api_client.get(url)
+        b"".join(second.streaming_content)
+        assert pdf_cache.stats()["hits"] == 3
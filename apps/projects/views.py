@@ -1,13 +1,13 @@
-import io
-import logging
-import zipfile
-
-from django.http import FileResponse
+from django.http import StreamingHttpResponse
 from django.utils import timezone
+from django.utils.http import content_disposition_header
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import extend_schema, extend_schema_view
-from handouts.utils import generate_handout_pdf
-from rest_framework import permissions, serializers, viewsets
+from handouts.enums import ExportJobKind
+from handouts.serializers import ExportJobSerializer
+from handouts.tasks import enqueue_export_job
+from handouts.utils import stream_handouts_zip
+from rest_framework import permissions, serializers, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.filters import OrderingFilter, SearchFilter
 from rest_framework.response import Response
@@ -15,10 +15,6 @@ from rest_framework.response import Response
 from .models import Folder, Project, Tag
 from .serializers import FolderSerializer, ProjectSerializer, TagSerializer
 
-logger = logging.getLogger("download_zip")
-logger.setLevel(logging.DEBUG)
-logger.addHandler(logging.StreamHandler())
-
 
 class TagViewSet(viewsets.ModelViewSet):
     serializer_class = TagSerializer
@@ -73,21 +69,17 @@ class ProjectViewSet(viewsets.ModelViewSet):
         if not handouts.exists():
             return Response({"error": "No handouts in this project."}, status=400)
 
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            for handout in handouts:
-                try:
-                    pdf_content = generate_handout_pdf(handout)
-                    if pdf_content:
-                        safe_title = "".join([c for c in handout.title if c.isalnum() or c in (" ", "-", "_")]).strip()
-                        zip_file.writestr(f"{safe_title}.pdf", pdf_content)
-                except Exception as e:
-                    logger.error(f"Failed to add {handout.title} to zip: {str(e)}")
-
-        zip_buffer.seek(0)
         filename = f"{project.name}_{timezone.now().strftime('%Y%m%d%H%M')}.zip"
-
-        return FileResponse(zip_buffer, as_attachment=True, filename=filename, content_type="application/zip")
+        if request.query_params.get("async", "").lower() in ("1", "true"):
+            job = enqueue_export_job(
+                owner=request.user, project=project, kind=ExportJobKind.ZIP, artifact_name=filename
+            )
+            serializer = ExportJobSerializer(job, context={"request": request})
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+        response = StreamingHttpResponse(stream_handouts_zip(handouts), content_type="application/zip")
+        response["Content-Disposition"] = content_disposition_header(True, filename)
+        return response
 
 
 @extend_schema_view(
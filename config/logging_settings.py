@@ -0,0 +1,23 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RENDER_LOG_LEVEL = os.getenv("RENDER_LOG_LEVEL", "INFO")
+WEASYPRINT_LOG_LEVEL = os.getenv("WEASYPRINT_LOG_LEVEL", "WARNING")
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "simple": {"format": "{asctime} {levelname} {name} {message}", "style": "{"},
+    },
+    "handlers": {
+        "console": {"class": "logging.StreamHandler", "formatter": "simple"},
+    },
+    "loggers": {
+        "handouts": {"handlers": ["console"], "level": RENDER_LOG_LEVEL, "propagate": False},
+        "weasyprint": {"handlers": ["console"], "level": WEASYPRINT_LOG_LEVEL, "propagate": False},
+    },
+}
@@ -0,0 +1,105 @@
+import os
+from pathlib import Path
+
+from celery.schedules import crontab
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+PDF_CACHE_DIR = Path(os.getenv("PDF_CACHE_DIR", BASE_DIR / "cache" / "pdf"))
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+
+EXPORT_ARTIFACT_DIR = Path(os.getenv("EXPORT_ARTIFACT_DIR", BASE_DIR / "cache" / "exports"))
+# Finished export files are deleted after this many seconds; their download link then answers 410.
+EXPORT_ARTIFACT_MAX_AGE = int(os.getenv("EXPORT_ARTIFACT_MAX_AGE", 24 * 60 * 60))
+
+MATH_CACHE_DIR = Path(os.getenv("MATH_CACHE_DIR", BASE_DIR / "cache" / "math"))
+MATH_CACHE_MAX_BYTES = int(os.getenv("MATH_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+CODE_HIGHLIGHT_CACHE_DIR = Path(os.getenv("CODE_HIGHLIGHT_CACHE_DIR", BASE_DIR / "cache" / "highlight"))
+CODE_HIGHLIGHT_CACHE_MAX_BYTES = int(os.getenv("CODE_HIGHLIGHT_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+
+PDF_FETCH_CACHE_DIR = Path(os.getenv("PDF_FETCH_CACHE_DIR", BASE_DIR / "cache" / "assets"))
+PDF_FETCH_CACHE_MAX_BYTES = int(os.getenv("PDF_FETCH_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+PDF_FETCH_MAX_OBJECT_BYTES = int(os.getenv("PDF_FETCH_MAX_OBJECT_BYTES", 50 * 1024 * 1024))
+# Remote responses larger than this fail the fetch instead of being read into the renderer's memory.
+PDF_REMOTE_FETCH_MAX_BYTES = int(os.getenv("PDF_REMOTE_FETCH_MAX_BYTES", 50 * 1024 * 1024))
+PDF_FETCH_CACHE_TTL = int(os.getenv("PDF_FETCH_CACHE_TTL", 24 * 60 * 60))
+PDF_FETCH_TIMEOUT = int(os.getenv("PDF_FETCH_TIMEOUT", 10))
+PDF_FETCH_LOCAL_MEDIA_URL = os.getenv("PDF_FETCH_LOCAL_MEDIA_URL", "http://localhost:8000/media/")
+
+# Images wider than they can print on A4 at this resolution are embedded as cached, re-encoded
+# variants; 0 embeds every image as uploaded.
+PDF_IMAGE_CACHE_DIR = Path(os.getenv("PDF_IMAGE_CACHE_DIR", BASE_DIR / "cache" / "images"))
+PDF_IMAGE_CACHE_MAX_BYTES = int(os.getenv("PDF_IMAGE_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+PDF_IMAGE_DPI = int(os.getenv("PDF_IMAGE_DPI", 200))
+PDF_IMAGE_JPEG_QUALITY = int(os.getenv("PDF_IMAGE_JPEG_QUALITY", 85))
+
+PDF_THUMBNAIL_CACHE_DIR = Path(os.getenv("PDF_THUMBNAIL_CACHE_DIR", BASE_DIR / "cache" / "thumbnails"))
+PDF_THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv("PDF_THUMBNAIL_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+PDF_THUMBNAIL_WIDTH = int(os.getenv("PDF_THUMBNAIL_WIDTH", 320))
+PDF_THUMBNAIL_PAGES = int(os.getenv("PDF_THUMBNAIL_PAGES", 3))
+PDF_THUMBNAIL_MAX_AGE = int(os.getenv("PDF_THUMBNAIL_MAX_AGE", 365 * 24 * 60 * 60))
+
+PDF_RENDER_QUEUE = os.getenv("PDF_RENDER_QUEUE", "render")
+PDF_RENDER_POOL_ENABLED = os.getenv("PDF_RENDER_POOL_ENABLED", "False") == "True"
+PDF_RENDER_POOL_TIMEOUT = int(os.getenv("PDF_RENDER_POOL_TIMEOUT", 120))
+PDF_RENDER_WORKER_WARMUP = os.getenv("PDF_RENDER_WORKER_WARMUP", "False") == "True"
+# Renders run in a forked child under the owner's Tier time and memory limits.
+PDF_RENDER_SANDBOX_ENABLED = os.getenv("PDF_RENDER_SANDBOX_ENABLED", "True") == "True"
+# Concurrent requests for one handout version wait on a shared lock for the first render, and for
+# no longer than this. Must outlast the slowest render, or waiters will start their own. The lock
+# lives in the Django cache, so it only spans processes when REDIS_CACHE_URL is set.
+PDF_RENDER_LOCK_TIMEOUT = int(os.getenv("PDF_RENDER_LOCK_TIMEOUT", 10 * 60))
+# A failed render is raised to its waiters and to new requests for this long instead of being retried.
+PDF_RENDER_FAILURE_TTL = int(os.getenv("PDF_RENDER_FAILURE_TTL", 30))
+# Handouts whose section HTML adds up to this many characters are laid out one top-level section
+# at a time and stitched, bounding peak memory by the largest chapter. 0 disables chunking.
+PDF_CHUNKED_RENDER_MIN_HTML_SIZE = int(os.getenv("PDF_CHUNKED_RENDER_MIN_HTML_SIZE", 1024 * 1024))
+
+# Saves schedule a background render this many seconds after the last edit in a burst. The debounce
+# flags live in the Django cache, which the render worker only shares when REDIS_CACHE_URL is set.
+PDF_PRERENDER_ENABLED = os.getenv("PDF_PRERENDER_ENABLED", str(bool(os.getenv("REDIS_CACHE_URL")))) == "True"
+PDF_PRERENDER_DELAY = int(os.getenv("PDF_PRERENDER_DELAY", 10))
+PDF_WARMUP_HOUR = int(os.getenv("PDF_WARMUP_HOUR", 3))
+
+# Fraction of section renders whose (truncated) HTML is logged at DEBUG level.
+PDF_RENDER_LOG_SAMPLE_RATE = float(os.getenv("PDF_RENDER_LOG_SAMPLE_RATE", 0.01))
+
+PDF_ZIP_WORKERS = int(os.getenv("PDF_ZIP_WORKERS", 4))
+
+# "stream" sends the cached file from this process (sendfile-capable); "redirect" answers with a
+# short-lived signed link to the download route, which a proxy or CDN can serve and cache.
+PDF_DOWNLOAD_MODE = os.getenv("PDF_DOWNLOAD_MODE", "stream")
+PDF_SIGNED_URL_MAX_AGE = int(os.getenv("PDF_SIGNED_URL_MAX_AGE", 5 * 60))
+
+# With a Redis URL, download events are buffered there and written in batches by the beat-scheduled
+# flush task. Without one, each download is written straight to the database.
+ANALYTICS_BUFFER_URL = os.getenv("ANALYTICS_BUFFER_URL", os.getenv("REDIS_CACHE_URL"))
+ANALYTICS_FLUSH_INTERVAL = int(os.getenv("ANALYTICS_FLUSH_INTERVAL", 60))
+ANALYTICS_FLUSH_BATCH_SIZE = int(os.getenv("ANALYTICS_FLUSH_BATCH_SIZE", 5000))
+
+# Run by the beat service in docker-compose.yml.
+CELERY_BEAT_SCHEDULE = {
+    "flush-download-events": {
+        "task": "handouts.tasks.flush_download_events",
+        "schedule": ANALYTICS_FLUSH_INTERVAL,
+    },
+    "purge-export-artifacts": {
+        "task": "handouts.tasks.purge_export_artifacts",
+        "schedule": 60 * 60,
+    },
+    "warm-published-handouts": {
+        "task": "handouts.tasks.warm_published_handouts",
+        "schedule": crontab(hour=PDF_WARMUP_HOUR, minute=0),
+    },
+}
+
+CELERY_TASK_ROUTES = {
+    "handouts.tasks.render_handout_pdf_task": {"queue": PDF_RENDER_QUEUE},
+    "handouts.tasks.run_export_job": {"queue": PDF_RENDER_QUEUE},
+    "handouts.tasks.prerender_handout": {"queue": PDF_RENDER_QUEUE},
+    "handouts.tasks.warm_published_handouts": {"queue": PDF_RENDER_QUEUE},
+}
@@ -12,6 +12,8 @@ load_dotenv(os.path.join(BASE_DIR, ".env"))
 
 from .cloudinary_settings import CLOUDINARY_STORAGE as CL_STORAGE
 from .jwt_settings import SIMPLE_JWT
+from .logging_settings import LOGGING
+from .pdf_settings import *
 from .RESTframework_settings import REST_FRAMEWORK
 from .smtp_settings import *
 from .swagger_settings import SPECTACULAR_SETTINGS
@@ -145,4 +147,12 @@ CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND")
 CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 
+REDIS_CACHE_URL = os.getenv("REDIS_CACHE_URL")
+if REDIS_CACHE_URL:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": REDIS_CACHE_URL}}
+else:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
 SIMPLE_JWT = SIMPLE_JWT
+
+LOGGING = LOGGING